@@ -0,0 +1,124 @@
+from functools import lru_cache
+from typing import Annotated
+
+import phonenumbers
+from email_validator import EmailNotValidError, validate_email
+from pydantic import AfterValidator
+from sqlalchemy import text
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+import database
+
+# Canonical lookup keys for addresses: E.164 for phone numbers
+# ("tel:+1-201-666-1234" and "+1 (201) 666-1234" are both "+12016661234") and
+# the lowercased, normalized form for emails. Users and contacts store them in
+# phone_key / email_key, inbound messages are resolved by exact match on them.
+# Parsing is pure, so results are memoized for the life of the process; invalid
+# input raises and is not cached.
+
+
+@lru_cache(maxsize=config.ADDRESS_KEY_CACHE_SIZE)
+def phone_key(value: str) -> str:
+    try:
+        number = phonenumbers.parse(value, config.PHONE_DEFAULT_REGION)
+    except phonenumbers.NumberParseException:
+        raise ValueError("value is not a valid phone number") from None
+    if not phonenumbers.is_valid_number(number):
+        raise ValueError("value is not a valid phone number")
+    return phonenumbers.format_number(number, phonenumbers.PhoneNumberFormat.E164)
+
+
+@lru_cache(maxsize=config.ADDRESS_KEY_CACHE_SIZE)
+def email_key(value: str) -> str:
+    try:
+        email = validate_email(value, check_deliverability=False)
+    except EmailNotValidError as e:
+        raise ValueError(f"value is not a valid email address: {e}") from None
+    return email.normalized.lower()
+
+
+def address_key(value: str) -> str:
+    return email_key(value) if "@" in value else phone_key(value)
+
+
+def address_keys(row) -> dict:
+    # Keys for a user or contact, for model_validate(update=...) and inserts
+    return {
+        "phone_key": phone_key(row.phone_number) if row.phone_number else None,
+        "email_key": email_key(row.email_address) if row.email_address else None,
+    }
+
+
+def key_cache_stats():
+    return {"phone_key": phone_key.cache_info()._asdict(), "email_key": email_key.cache_info()._asdict()}
+
+
+# A phone number or email address, validated and replaced by its key
+Address = Annotated[str, AfterValidator(address_key)]
+
+
+BACKFILL = """
+    UPDATE {table} AS t SET phone_key = k.phone_key, email_key = k.email_key
+    FROM unnest(CAST(:ids AS integer[]), CAST(:phone_keys AS text[]), CAST(:email_keys AS text[]))
+        AS k(id, phone_key, email_key)
+    WHERE t.id = k.id
+"""
+
+
+def try_key(key, value):
+    try:
+        return key(value) if value else None
+    except ValueError:
+        return None
+
+
+async def backfill(session: AsyncSession, model, batch_size: int):
+    # Rows written before the key columns existed. Stored addresses that no
+    # longer parse keep a NULL key and are reported.
+    statement = text(BACKFILL.format(table=model.__tablename__))
+    after_id = 0
+    updated = invalid = 0
+    while True:
+        rows = (await session.exec(
+            select(model.id, model.phone_number, model.email_address).where(
+                (model.id > after_id) & (model.phone_key.is_(None) | model.email_key.is_(None))
+            ).order_by(model.id).limit(batch_size)
+        )).all()
+        if not rows:
+            return updated, invalid
+        keys = [(try_key(phone_key, row.phone_number), try_key(email_key, row.email_address)) for row in rows]
+        invalid += sum(
+            (row.phone_number is not None and phone is None) or (row.email_address is not None and email is None)
+            for row, (phone, email) in zip(rows, keys)
+        )
+        await session.exec(statement, params={
+            "ids": [row.id for row in rows],
+            "phone_keys": [phone for phone, _ in keys],
+            "email_keys": [email for _, email in keys],
+        })
+        await session.commit()
+        updated += len(rows)
+        after_id = rows[-1].id
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    from models.sql.contacts import Contact
+    from models.sql.user import User
+
+    parser = argparse.ArgumentParser(description="Fill phone_key and email_key on existing users and contacts")
+    parser.add_argument("--batch-size", type=int, default=config.ADDRESS_BACKFILL_BATCH_SIZE)
+
+    async def main(args):
+        database.init_engine()
+        async with database.session_factory() as session:
+            for model in (User, Contact):
+                updated, invalid = await backfill(session, model, args.batch_size)
+                print(f"{model.__tablename__}: {updated} rows keyed, {invalid} with unparseable addresses")
+        await database.dispose_engine()
+
+    asyncio.run(main(parser.parse_args()))
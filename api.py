@@ -1,13 +1,44 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 
-from routers import users, contacts, messages, test
+import config
+from metrics import MetricsMiddleware
+from database import init_engine, dispose_engine, create_schema
+from providers import start_clients, close_clients
+from delivery import start_workers, stop_workers
+from stream import start_listener, stop_listener
+from partitions import start_maintenance, stop_maintenance
+from routers import users, contacts, conversations, messages, attachments, health, metrics, test
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_engine()
+    if config.DB_CREATE_SCHEMA:
+        await create_schema()
+    await start_maintenance()
+    await start_clients()
+    await start_workers()
+    await start_listener()
+    yield
+    await stop_listener()
+    await stop_workers()
+    await close_clients()
+    await stop_maintenance()
+    await dispose_engine()
 
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(users.router)
 app.include_router(contacts.router)
+app.include_router(conversations.router)
 app.include_router(messages.router)
+app.include_router(attachments.router)
+app.include_router(health.router)
+app.include_router(metrics.router)
 app.include_router(test.router)
 
 
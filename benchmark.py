@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+import subprocess
+import uuid
+from collections import Counter
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+from time import perf_counter
+
+import httpx
+
+# Load test for the API. Runs in-process through httpx's ASGI transport (the
+# fake provider under /test is then called in-process as well) or against a
+# running server. Results are saved per commit under benchmark_results/ so
+# runs can be compared with --compare.
+#
+#   python benchmark.py                          # in-process, all scenarios
+#   python benchmark.py --url http://127.0.0.1:8000 --concurrency 50
+#   python benchmark.py --provider-latency 0.05 --provider-max-concurrency 20
+#   python benchmark.py --compare 5487d79
+#   python benchmark.py --concurrency 1 --requests 2000 --scenarios send,receive,users,contacts,conversations
+#   python benchmark.py --serializers
+#
+# The concurrency 1 run keeps the event loop free of contention, so
+# per-request overhead such as response serialization shows up in the
+# latencies. --serializers times response encoding alone, without a database:
+# jsonable_encoder + json.dumps against the response models' serializers.
+
+RESULTS_DIR = Path(__file__).parent / "benchmark_results"
+SCENARIOS = ["send", "receive", "users", "contacts", "conversations", "history"]
+
+
+class Fixture:
+    def __init__(self, run: int):
+        self.run = run
+        # (user id, contact id) pairs; user i is paired with contact i
+        self.pairs = []
+        self.conversation_ids = []
+
+    def user_phone(self, i: int):
+        return f"+1201{self.run}{i:04d}"
+
+    def contact_phone(self, i: int):
+        return f"+1804{self.run}{i:04d}"
+
+
+def percentile(values: list[float], p: float):
+    # Nearest rank on an already sorted list
+    if not values:
+        return None
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+async def seed(client: httpx.AsyncClient, fixture: Fixture, users: int):
+    # Phone numbers and emails carry a per-run prefix so repeated runs against
+    # the same database never resolve to rows from an earlier run
+    async def create(i):
+        user = (await client.put("/users/", json={
+            "name": f"Bench User {i}",
+            "phone_number": fixture.user_phone(i),
+            "email_address": f"bench-{fixture.run}-user-{i}@example.com",
+        })).raise_for_status().json()
+        contact = (await client.put("/contacts/", json={
+            "user_id": user["id"],
+            "name": f"Bench Contact {i}",
+            "phone_number": fixture.contact_phone(i),
+            "email_address": f"bench-{fixture.run}-contact-{i}@example.com",
+        })).raise_for_status().json()
+        return user["id"], contact["id"]
+
+    semaphore = asyncio.Semaphore(20)
+
+    async def bounded(i):
+        async with semaphore:
+            return await create(i)
+
+    fixture.pairs = await asyncio.gather(*(bounded(i) for i in range(users)))
+
+
+async def load_conversations(client: httpx.AsyncClient, fixture: Fixture):
+    for user_id, _ in fixture.pairs[:50]:
+        response = await client.get(f"/users/{user_id}/conversations")
+        if response.status_code == 200:
+            fixture.conversation_ids.extend(item["id"] for item in response.json()["items"])
+
+
+def make_request(name: str, fixture: Fixture, args):
+    pairs = fixture.pairs
+
+    if name == "send":
+        params = {"deferred": "true"} if args.deferred else {}
+        if args.echo:
+            params["echo"] = "true"
+
+        def request(client, i):
+            user_id, contact_id = pairs[i % len(pairs)]
+            return client.post("/messages/send", params=params, json={
+                "user_id": user_id,
+                "contact_id": contact_id,
+                "message_type": "email" if i % 2 else "sms",
+                "content": f"bench message {i}",
+                "timestamp": now(),
+            })
+    elif name == "receive":
+        params = {"echo": "true"} if args.echo else None
+
+        def request(client, i):
+            index = i % len(pairs)
+            return client.post("/messages/receive", params=params, json={
+                "from": fixture.contact_phone(index),
+                "to": fixture.user_phone(index),
+                "type": "sms",
+                "messaging_provider_id": str(uuid.uuid4()),
+                "body": f"bench reply {i}",
+                "attachment": None,
+                "timestamp": now(),
+            })
+    elif name == "users":
+        def request(client, i):
+            return client.get("/users/", params={"limit": args.page_size})
+    elif name == "contacts":
+        def request(client, i):
+            return client.get("/contacts/", params={"user_id": pairs[i % len(pairs)][0], "limit": args.page_size})
+    elif name == "conversations":
+        def request(client, i):
+            return client.get(f"/users/{pairs[i % len(pairs)][0]}/conversations", params={"limit": args.page_size})
+    elif name == "history":
+        def request(client, i):
+            conversation_id = fixture.conversation_ids[i % len(fixture.conversation_ids)]
+            return client.get(f"/conversations/{conversation_id}/messages", params={"limit": args.page_size})
+    else:
+        raise ValueError(f"Unknown scenario {name}")
+    return request
+
+
+async def run_scenario(client: httpx.AsyncClient, request, total: int, concurrency: int, warmup: int):
+    for i in range(warmup):
+        await request(client, i)
+
+    latencies = []
+    statuses = Counter()
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < total:
+            i = next_index
+            next_index += 1
+            started = perf_counter()
+            try:
+                response = await request(client, warmup + i)
+                statuses[str(response.status_code)] += 1
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+            latencies.append(perf_counter() - started)
+
+    started = perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 4),
+        "throughput": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2),
+        "statuses": dict(statuses),
+    }
+
+
+@asynccontextmanager
+async def asgi_client():
+    import providers
+    from api import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        # Provider calls are routed to the fake provider in this process
+        # instead of over the network
+        for provider, client in list(providers.clients.items()):
+            await client.aclose()
+            providers.clients[provider] = httpx.AsyncClient(transport=transport)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=60) as client:
+            yield client
+
+
+@asynccontextmanager
+async def http_client(url: str, concurrency: int):
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=60) as client:
+        yield client
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], capture_output=True, text=True, check=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+    return commit, dirty
+
+
+def load_results(reference: str):
+    path = Path(reference)
+    if not path.exists():
+        path = RESULTS_DIR / f"{reference}.json"
+    return json.loads(path.read_text())
+
+
+def print_results(results: dict, baseline: dict | None):
+    print(f"{'scenario':<14}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  statuses")
+    for name, result in results["scenarios"].items():
+        line = (
+            f"{name:<14}{result['throughput']:>10}{result['p50_ms']:>10}"
+            f"{result['p95_ms']:>10}{result['p99_ms']:>10}  {result['statuses']}"
+        )
+        previous = (baseline or {}).get("scenarios", {}).get(name)
+        if previous:
+            throughput = (result["throughput"] / previous["throughput"] - 1) * 100
+            p95 = (result["p95_ms"] / previous["p95_ms"] - 1) * 100 if previous["p95_ms"] else 0.0
+            line += f"  vs {baseline['commit']}: {throughput:+.1f}% req/s, {p95:+.1f}% p95"
+        print(line)
+
+
+def time_call(call, repeat: int) -> float:
+    # Best of three, in microseconds per call
+    best = math.inf
+    for _ in range(3):
+        started = perf_counter()
+        for _ in range(repeat):
+            call()
+        best = min(best, perf_counter() - started)
+    return best / repeat * 1e6
+
+
+def serializers(args):
+    from typing import List
+
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import TypeAdapter
+
+    from models.enums import DeliveryStatus, MessageType
+    from models.messages import MessageAccepted, MessageRead, SentMessageEcho
+    from models.sql.messages import Message
+    from models.sql.user import User
+    from models.users import UserRead
+
+    users = [
+        User(id=i, name=f"User {i}", phone_number=f"tel:+1-201-555-{i:04d}", email_address=f"user{i}@example.com",
+             phone_key=f"+1201555{i:04d}", email_key=f"user{i}@example.com")
+        for i in range(args.page_size)
+    ]
+    message = Message(
+        id=1, conversation_id=1, user_id=1, contact_id=1, message_type=MessageType.sms,
+        status=DeliveryStatus.sent, content="bench message", timestamp=datetime.now(timezone.utc)
+    )
+    provider_request = {"from": "+12015550001", "to": "+18045550001", "type": "sms", "body": "bench message"}
+    user_page = TypeAdapter(List[UserRead])
+    accepted = TypeAdapter(MessageAccepted)
+    echoed = TypeAdapter(SentMessageEcho)
+
+    cases = [
+        (f"users page ({args.page_size} rows)",
+         lambda: json.dumps(jsonable_encoder(users)).encode(),
+         lambda: user_page.dump_json(user_page.validate_python([user.model_dump() for user in users]))),
+        ("send response",
+         lambda: json.dumps(jsonable_encoder([message, provider_request, provider_request])).encode(),
+         lambda: accepted.dump_json(MessageAccepted(id=1, status=DeliveryStatus.sent, conversation_id=1))),
+        ("send response, echo",
+         lambda: json.dumps(jsonable_encoder([message, provider_request, provider_request])).encode(),
+         lambda: echoed.dump_json(SentMessageEcho(
+             id=1, status=DeliveryStatus.sent, conversation_id=1,
+             message=MessageRead.model_validate(message, from_attributes=True),
+             provider_request=provider_request, provider_response=provider_request
+         ))),
+    ]
+    print(f"{'response':<28}{'before us':>11}{'after us':>10}")
+    for name, before, after in cases:
+        print(f"{name:<28}{time_call(before, args.requests):>11.1f}{time_call(after, args.requests):>10.1f}")
+
+
+async def main(args):
+    baseline = load_results(args.compare) if args.compare else None
+    scenarios = args.scenarios.split(",")
+    # Exchange codes ending in 11 (N11 service codes) are not valid numbers
+    fixture = Fixture(random.choice([run for run in range(200, 1000) if run % 100 != 11]))
+    connect = http_client(args.url, args.concurrency) if args.url else asgi_client()
+
+    async with connect as client:
+        (await client.put("/test/provider", json={
+            "latency": args.provider_latency,
+            "jitter": args.provider_jitter,
+            "error_rate": args.provider_error_rate,
+            "throttle_rate": args.provider_throttle_rate,
+            "max_concurrency": args.provider_max_concurrency,
+            "retry_after": args.provider_retry_after,
+        })).raise_for_status()
+        await seed(client, fixture, args.users)
+
+        results = {}
+        for name in scenarios:
+            if name == "history":
+                await load_conversations(client, fixture)
+                if not fixture.conversation_ids:
+                    print("history: no conversations yet, run send or receive first")
+                    continue
+            request = make_request(name, fixture, args)
+            results[name] = await run_scenario(client, request, args.requests, args.concurrency, args.warmup)
+        provider = (await client.get("/test/provider")).json()
+
+    commit, dirty = git_revision()
+    output = {
+        "commit": commit,
+        "dirty": dirty,
+        "target": args.url or "asgi",
+        "finished_at": now(),
+        "settings": vars(args),
+        "fake_provider": provider,
+        "scenarios": results,
+    }
+    print_results(output, baseline)
+
+    if not args.no_save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        path = RESULTS_DIR / f"{commit}{'-dirty' if dirty else ''}.json"
+        path.write_text(json.dumps(output, indent=2))
+        print(f"saved {path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the messaging API")
+    parser.add_argument("--url", help="Benchmark a running server instead of the app in-process")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=1000, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests before each scenario")
+    parser.add_argument("--users", type=int, default=100, help="Users (each with one contact) to create")
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--deferred", action="store_true", help="Send through the outbox instead of inline")
+    parser.add_argument("--echo", action="store_true", help="Ask send and receive for the full echoed response")
+    parser.add_argument("--provider-latency", type=float, default=0.0)
+    parser.add_argument("--provider-jitter", type=float, default=0.0)
+    parser.add_argument("--provider-error-rate", type=float, default=0.0)
+    parser.add_argument("--provider-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--provider-max-concurrency", type=int, default=0)
+    parser.add_argument("--provider-retry-after", type=float, default=1.0)
+    parser.add_argument("--compare", help="Commit (or results file) to compare against")
+    parser.add_argument("--no-save", action="store_true")
+    parser.add_argument("--serializers", action="store_true", help="Only time response serialization, in-process")
+    args = parser.parse_args()
+    if args.serializers:
+        serializers(args)
+    else:
+        asyncio.run(main(args))
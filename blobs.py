@@ -0,0 +1,67 @@
+import hashlib
+import os
+import re
+import uuid
+from pathlib import Path
+
+import anyio
+
+import config
+
+# Attachment content is stored once per distinct SHA-256, at
+# ATTACHMENT_DIR/<first two hex digits>/<sha256>. Uploads are written to a
+# temporary file while they are hashed and only renamed into place once their
+# row is committed, so any path that exists holds complete content and a failed
+# upload leaves no file behind. A row whose file went missing is served as 404
+# and healed by uploading the same content again.
+
+ID = re.compile(r"^[0-9a-f]{64}$")
+
+
+def is_id(value: str) -> bool:
+    return ID.match(value) is not None
+
+
+def path_for(attachment_id: str) -> Path:
+    return Path(config.ATTACHMENT_DIR) / attachment_id[:2] / attachment_id
+
+
+def url_for(attachment_id: str) -> str:
+    return f"{config.ATTACHMENT_BASE_URL}/attachments/{attachment_id}"
+
+
+async def receive(chunks) -> tuple[str, int, anyio.Path]:
+    # Returns (id, size, temporary file); raises ValueError past
+    # ATTACHMENT_MAX_SIZE. The caller places or discards the file.
+    partial = anyio.Path(config.ATTACHMENT_DIR) / "tmp" / uuid.uuid4().hex
+    await partial.parent.mkdir(parents=True, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        async with await anyio.open_file(partial, "wb") as file:
+            async for chunk in chunks:
+                size += len(chunk)
+                if size > config.ATTACHMENT_MAX_SIZE:
+                    raise ValueError(f"Attachment exceeds {config.ATTACHMENT_MAX_SIZE} bytes")
+                digest.update(chunk)
+                await file.write(chunk)
+    except BaseException:
+        await discard(partial)
+        raise
+    return digest.hexdigest(), size, partial
+
+
+async def place(partial: anyio.Path, attachment_id: str):
+    path = anyio.Path(path_for(attachment_id))
+    # Already stored content is kept as is
+    if not await path.exists():
+        await path.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(partial, path)
+
+
+async def discard(partial: anyio.Path):
+    await partial.unlink(missing_ok=True)
+
+
+async def exists(attachment_id: str) -> bool:
+    return await anyio.Path(path_for(attachment_id)).is_file()
@@ -0,0 +1,127 @@
+from collections import OrderedDict
+from functools import wraps
+from time import monotonic
+
+import config
+from addresses import key_cache_stats
+
+MISSING = object()
+
+
+class TTLCache:
+    # Bounded LRU cache with per-entry expiry. None is cached as a negative
+    # entry with its own (usually shorter) TTL.
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        value, expires_at = entry
+        if expires_at <= monotonic():
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        ttl = self.negative_ttl if value is None else self.ttl
+        if ttl <= 0 or self.maxsize <= 0:
+            return
+        self.entries[key] = (value, monotonic() + ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        if self.entries.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def memoize(self, kind: str):
+        # For async resolvers shaped like fn(session, value)
+        def decorator(fn):
+            @wraps(fn)
+            async def wrapper(session, value):
+                key = (kind, value)
+                result = self.get(key)
+                if result is MISSING:
+                    result = await fn(session, value)
+                    self.set(key, result)
+                return result
+            return wrapper
+        return decorator
+
+    async def get_many(self, kind: str, values, load):
+        # load(missing_values) returns a dict for the values it found; values
+        # it did not return are cached as negative entries
+        found = {}
+        missing = set()
+        for value in values:
+            result = self.get((kind, value))
+            if result is MISSING:
+                missing.add(value)
+            elif result is not None:
+                found[value] = result
+        if missing:
+            loaded = await load(missing)
+            for value in missing:
+                result = loaded.get(value)
+                self.set((kind, value), result)
+                if result is not None:
+                    found[value] = result
+        return found
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+        }
+
+
+# (kind, address key) -> id, e.g. ("users.phone_key", "+12016661234") -> 1.
+# Contacts are keyed within their user: ("contacts.phone_key", (1, "+18045551234"))
+ids_by_address = TTLCache(config.ADDRESS_CACHE_SIZE, config.ADDRESS_CACHE_TTL, config.ADDRESS_CACHE_NEGATIVE_TTL)
+# (kind, id) -> address key, e.g. ("contacts.email_key", 1) -> "john.smith@example.com"
+addresses_by_id = TTLCache(config.ADDRESS_CACHE_SIZE, config.ADDRESS_CACHE_TTL, config.ADDRESS_CACHE_NEGATIVE_TTL)
+# (kind, provider message id) -> (message id, conversation id). Misses are not
+# cached, the unique index catches whatever this does not know about.
+received_messages = TTLCache(config.RECEIVED_CACHE_SIZE, config.RECEIVED_CACHE_TTL, 0)
+
+
+def invalidate_addresses(table: str, row):
+    for column in ("phone_key", "email_key"):
+        kind = f"{table}.{column}"
+        key = getattr(row, column)
+        ids_by_address.invalidate((kind, (row.user_id, key) if table == "contacts" else key))
+        addresses_by_id.invalidate((kind, row.id))
+
+
+def cache_stats():
+    return {
+        "ids_by_address": ids_by_address.stats(),
+        "addresses_by_id": addresses_by_id.stats(),
+        "received_messages": received_messages.stats(),
+        "address_keys": key_cache_stats(),
+    }
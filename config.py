@@ -0,0 +1,173 @@
+import os
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.getenv(name)
+    return float(value) if value else default
+
+
+DB_NAME = os.getenv("DB_NAME", "hatch")
+DB_USER = os.getenv("DB_USER", "user")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "password")
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = _env_int("DB_PORT", 5432)
+
+# DATABASE_URL takes precedence over the individual DB_* settings
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}",
+)
+
+DB_ECHO = _env_bool("DB_ECHO", False)
+DB_POOL_SIZE = _env_int("DB_POOL_SIZE", 10)
+DB_MAX_OVERFLOW = _env_int("DB_MAX_OVERFLOW", 10)
+DB_POOL_TIMEOUT = _env_int("DB_POOL_TIMEOUT", 30)
+DB_POOL_RECYCLE = _env_int("DB_POOL_RECYCLE", 1800)
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+
+# Create missing tables and migrate existing ones (migrations.py) when the app
+# starts. Turn this off once the schema is managed out of band
+# (`python database.py`).
+DB_CREATE_SCHEMA = _env_bool("DB_CREATE_SCHEMA", True)
+
+
+PROVIDER_HTTP2 = _env_bool("PROVIDER_HTTP2", False)
+PROVIDER_MAX_CONNECTIONS = _env_int("PROVIDER_MAX_CONNECTIONS", 100)
+PROVIDER_MAX_KEEPALIVE_CONNECTIONS = _env_int("PROVIDER_MAX_KEEPALIVE_CONNECTIONS", 20)
+PROVIDER_KEEPALIVE_EXPIRY = _env_float("PROVIDER_KEEPALIVE_EXPIRY", 30.0)
+PROVIDER_CONNECT_TIMEOUT = _env_float("PROVIDER_CONNECT_TIMEOUT", 5.0)
+PROVIDER_READ_TIMEOUT = _env_float("PROVIDER_READ_TIMEOUT", 10.0)
+PROVIDER_WRITE_TIMEOUT = _env_float("PROVIDER_WRITE_TIMEOUT", 10.0)
+PROVIDER_POOL_TIMEOUT = _env_float("PROVIDER_POOL_TIMEOUT", 5.0)
+
+# Outgoing rate limiting. RATE_LIMIT is a token bucket in requests per second
+# (0 disables it); concurrency adapts between MIN and MAX, growing additively
+# while the provider keeps up and shrinking by CONCURRENCY_DECREASE on 429/503.
+PROVIDER_RATE_LIMIT = _env_float("PROVIDER_RATE_LIMIT", 0.0)
+PROVIDER_RATE_BURST = _env_int("PROVIDER_RATE_BURST", 50)
+PROVIDER_CONCURRENCY_INITIAL = _env_int("PROVIDER_CONCURRENCY_INITIAL", 20)
+PROVIDER_CONCURRENCY_MIN = _env_int("PROVIDER_CONCURRENCY_MIN", 1)
+PROVIDER_CONCURRENCY_MAX = _env_int("PROVIDER_CONCURRENCY_MAX", PROVIDER_MAX_CONNECTIONS)
+PROVIDER_CONCURRENCY_DECREASE = _env_float("PROVIDER_CONCURRENCY_DECREASE", 0.5)
+# Inline sends retry 429 and 5xx responses only, with full jitter, or after
+# the provider's Retry-After when it sends one
+PROVIDER_MAX_ATTEMPTS = _env_int("PROVIDER_MAX_ATTEMPTS", 3)
+PROVIDER_RETRY_BASE = _env_float("PROVIDER_RETRY_BASE", 0.25)
+PROVIDER_RETRY_MAX = _env_float("PROVIDER_RETRY_MAX", 5.0)
+PROVIDER_RETRY_AFTER_MAX = _env_float("PROVIDER_RETRY_AFTER_MAX", 60.0)
+
+
+def provider_setting(provider: str, name: str, default):
+    # PROVIDER_<PROVIDER>_<NAME> overrides the global PROVIDER_<NAME> value
+    value = os.getenv(f"PROVIDER_{provider.upper()}_{name}")
+    if not value:
+        return default
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+# Queue /messages/send through the outbox and answer 202 instead of calling the
+# provider inline. Can be overridden per request with ?deferred=
+MESSAGES_SEND_DEFERRED = _env_bool("MESSAGES_SEND_DEFERRED", False)
+OUTBOX_WORKERS = _env_int("OUTBOX_WORKERS", 4)
+OUTBOX_BATCH_SIZE = _env_int("OUTBOX_BATCH_SIZE", 10)
+OUTBOX_POLL_INTERVAL = _env_float("OUTBOX_POLL_INTERVAL", 1.0)
+OUTBOX_LEASE_SECONDS = _env_float("OUTBOX_LEASE_SECONDS", 60.0)
+OUTBOX_MAX_ATTEMPTS = _env_int("OUTBOX_MAX_ATTEMPTS", 5)
+OUTBOX_BACKOFF_BASE = _env_float("OUTBOX_BACKOFF_BASE", 0.5)
+OUTBOX_BACKOFF_MAX = _env_float("OUTBOX_BACKOFF_MAX", 60.0)
+MESSAGES_BATCH_MAX_SIZE = _env_int("MESSAGES_BATCH_MAX_SIZE", 5000)
+MESSAGES_BATCH_CONCURRENCY = _env_int("MESSAGES_BATCH_CONCURRENCY", 50)
+MESSAGES_RECEIVE_CHUNK_SIZE = _env_int("MESSAGES_RECEIVE_CHUNK_SIZE", 1000)
+
+# Address resolution cache (phone/email <-> user/contact id). Entries are only
+# invalidated in the process that wrote them, so keep the negative TTL short
+# when running several workers.
+ADDRESS_CACHE_SIZE = _env_int("ADDRESS_CACHE_SIZE", 100_000)
+ADDRESS_CACHE_TTL = _env_float("ADDRESS_CACHE_TTL", 300.0)
+ADDRESS_CACHE_NEGATIVE_TTL = _env_float("ADDRESS_CACHE_NEGATIVE_TTL", 30.0)
+# Parsed phone numbers and emails, address -> canonical key (pure, never stale)
+ADDRESS_KEY_CACHE_SIZE = _env_int("ADDRESS_KEY_CACHE_SIZE", 100_000)
+# Region assumed for phone numbers given without a country code, e.g. "US";
+# unset requires the leading +
+PHONE_DEFAULT_REGION = os.getenv("PHONE_DEFAULT_REGION") or None
+ADDRESS_BACKFILL_BATCH_SIZE = _env_int("ADDRESS_BACKFILL_BATCH_SIZE", 1000)
+
+PAGE_LIMIT_DEFAULT = _env_int("PAGE_LIMIT_DEFAULT", 50)
+PAGE_LIMIT_MAX = _env_int("PAGE_LIMIT_MAX", 500)
+# Rows fetched per round trip by the server-side cursor behind NDJSON exports
+EXPORT_YIELD_PER = _env_int("EXPORT_YIELD_PER", 1000)
+
+IMPORT_CHUNK_SIZE = _env_int("IMPORT_CHUNK_SIZE", 5000)
+IMPORT_MAX_ERRORS = _env_int("IMPORT_MAX_ERRORS", 100)
+
+# Recently stored inbound messages by messageProviderID, so provider
+# redeliveries are answered without touching the database. The unique index on
+# messages.provider_message_id is what actually guarantees a single row.
+RECEIVED_CACHE_SIZE = _env_int("RECEIVED_CACHE_SIZE", 100_000)
+RECEIVED_CACHE_TTL = _env_float("RECEIVED_CACHE_TTL", 3600.0)
+
+# Idempotency-Key handling on /messages/send. Completed responses are kept for
+# IDEMPOTENCY_TTL. A request holds its key on a lease of IDEMPOTENCY_LOCK_TIMEOUT
+# that is renewed while it runs, so only a key whose first request never
+# finished (e.g. the process died) can be taken over.
+IDEMPOTENCY_TTL = _env_float("IDEMPOTENCY_TTL", 86400.0)
+IDEMPOTENCY_LOCK_TIMEOUT = _env_float("IDEMPOTENCY_LOCK_TIMEOUT", 60.0)
+IDEMPOTENCY_WAIT_TIMEOUT = _env_float("IDEMPOTENCY_WAIT_TIMEOUT", 30.0)
+IDEMPOTENCY_POLL_INTERVAL = _env_float("IDEMPOTENCY_POLL_INTERVAL", 0.1)
+IDEMPOTENCY_PURGE_INTERVAL = _env_float("IDEMPOTENCY_PURGE_INTERVAL", 300.0)
+
+# Defaults for the fake provider under /test, also adjustable at runtime with
+# PUT /test/provider
+FAKE_PROVIDER_LATENCY = _env_float("FAKE_PROVIDER_LATENCY", 0.0)
+FAKE_PROVIDER_JITTER = _env_float("FAKE_PROVIDER_JITTER", 0.0)
+FAKE_PROVIDER_ERROR_RATE = _env_float("FAKE_PROVIDER_ERROR_RATE", 0.0)
+FAKE_PROVIDER_THROTTLE_RATE = _env_float("FAKE_PROVIDER_THROTTLE_RATE", 0.0)
+FAKE_PROVIDER_MAX_CONCURRENCY = _env_int("FAKE_PROVIDER_MAX_CONCURRENCY", 0)
+FAKE_PROVIDER_RETRY_AFTER = _env_float("FAKE_PROVIDER_RETRY_AFTER", 1.0)
+
+# Live inbound messages on GET /users/{id}/stream. Stored messages are
+# published with NOTIFY on STREAM_CHANNEL and fanned out by one LISTEN
+# connection per process. Subscribers whose queue fills up are disconnected
+# and catch up from Last-Event-ID (at most STREAM_REPLAY_LIMIT messages).
+STREAM_NOTIFY = _env_bool("STREAM_NOTIFY", True)
+STREAM_CHANNEL = os.getenv("STREAM_CHANNEL", "inbound_messages")
+STREAM_QUEUE_SIZE = _env_int("STREAM_QUEUE_SIZE", 100)
+STREAM_HEARTBEAT = _env_float("STREAM_HEARTBEAT", 15.0)
+STREAM_RECONNECT_DELAY = _env_float("STREAM_RECONNECT_DELAY", 1.0)
+STREAM_REPLAY_LIMIT = _env_int("STREAM_REPLAY_LIMIT", 500)
+
+# Characters of the latest message kept on each conversation for inbox listings
+CONVERSATION_PREVIEW_LENGTH = _env_int("CONVERSATION_PREVIEW_LENGTH", 200)
+SUMMARY_REBUILD_BATCH_SIZE = _env_int("SUMMARY_REBUILD_BATCH_SIZE", 1000)
+
+# messages is partitioned by month on timestamp. Partitions are created this
+# many months ahead; with a retention set, older months are detached and
+# written to MESSAGE_ARCHIVE_DIR as gzipped NDJSON, then dropped.
+MESSAGE_PARTITIONS_AHEAD = _env_int("MESSAGE_PARTITIONS_AHEAD", 3)
+MESSAGE_RETENTION_MONTHS = _env_int("MESSAGE_RETENTION_MONTHS", 0)
+MESSAGE_ARCHIVE_DIR = os.getenv("MESSAGE_ARCHIVE_DIR", "archive")
+PARTITION_MAINTENANCE_INTERVAL = _env_float("PARTITION_MAINTENANCE_INTERVAL", 3600.0)
+
+# Content-addressed attachment store, see blobs.py. Messages reference
+# attachments by id; providers are given ATTACHMENT_BASE_URL/attachments/<id>.
+ATTACHMENT_DIR = os.getenv("ATTACHMENT_DIR", "attachments")
+ATTACHMENT_MAX_SIZE = _env_int("ATTACHMENT_MAX_SIZE", 25 * 1024 * 1024)
+ATTACHMENT_BASE_URL = os.getenv("ATTACHMENT_BASE_URL", "http://localhost:8000").rstrip("/")
+
+# Text search configuration of the message search index. Changing it needs
+# ix_messages_content_search rebuilt, or searches stop using the index.
+SEARCH_CONFIG = os.getenv("SEARCH_CONFIG", "english")
+SEARCH_QUERY_MAX_LENGTH = _env_int("SEARCH_QUERY_MAX_LENGTH", 256)
@@ -0,0 +1,205 @@
+import codecs
+import csv
+
+from pydantic import ValidationError
+from sqlalchemy import Column, Integer, BigInteger, MetaData, String, Table, text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+from cache import invalidate_addresses
+from addresses import address_keys
+from models.sql.contacts import ContactBase
+
+COLUMNS = ["seq", "user_id", "name", "phone_number", "email_address", "phone_key", "email_key"]
+
+# Per-transaction staging table, kept off SQLModel.metadata so create_all
+# never touches it
+staging = Table(
+    "contact_import",
+    MetaData(),
+    Column("seq", BigInteger),
+    Column("user_id", Integer),
+    Column("name", String),
+    Column("phone_number", String),
+    Column("email_address", String),
+    Column("phone_key", String),
+    Column("email_key", String),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+
+# Keeps the first staged row for each (user_id, phone) and (user_id, email),
+# drops rows that match an existing contact of the same user on either, and
+# rows that point at a user that does not exist. Addresses are compared on
+# their canonical keys, so differently formatted duplicates are caught too.
+# The unique indexes on contacts settle concurrent imports and PUT /contacts.
+MERGE = text("""
+    WITH ranked AS (
+        SELECT s.*,
+            row_number() OVER (PARTITION BY s.user_id, s.phone_key ORDER BY s.seq) AS phone_rank,
+            row_number() OVER (PARTITION BY s.user_id, s.email_key ORDER BY s.seq) AS email_rank
+        FROM contact_import s
+        JOIN users u ON u.id = s.user_id
+    )
+    INSERT INTO contacts (user_id, name, phone_number, email_address, phone_key, email_key)
+    SELECT r.user_id, r.name, r.phone_number, r.email_address, r.phone_key, r.email_key
+    FROM ranked r
+    WHERE (r.phone_key IS NULL OR r.phone_rank = 1)
+      AND (r.email_key IS NULL OR r.email_rank = 1)
+    ORDER BY r.seq
+    ON CONFLICT DO NOTHING
+    RETURNING id, user_id, phone_key, email_key
+""")
+
+UNKNOWN_USERS = text("""
+    SELECT s.seq FROM contact_import s
+    WHERE NOT EXISTS (SELECT 1 FROM users u WHERE u.id = s.user_id)
+    ORDER BY s.seq
+""")
+
+
+class ImportSummary:
+    def __init__(self):
+        self.rows = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.invalid = 0
+        self.errors = []
+
+    def error(self, row: int, detail):
+        self.invalid += 1
+        if len(self.errors) < config.IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "detail": detail})
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "skipped": self.skipped,
+            "invalid": self.invalid,
+            "errors": self.errors,
+        }
+
+
+async def iter_lines(chunks):
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+
+async def iter_ndjson(chunks):
+    async for line in iter_lines(chunks):
+        if line.strip():
+            yield line
+
+
+class Records:
+    # Input of the one csv.reader used per import. Only complete records are
+    # queued, so the reader never runs out of input inside a quoted field.
+    def __init__(self):
+        self.pending = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self.pending:
+            raise StopIteration
+        return self.pending.pop()
+
+
+async def iter_csv_records(chunks):
+    # Joins lines while a quoted field is open (an odd number of quotes so
+    # far), keeping the newlines inside it
+    record = ""
+    async for line in iter_lines(chunks):
+        record += line
+        if record.count('"') % 2:
+            record += "\n"
+            continue
+        yield record
+        record = ""
+    if record:
+        yield record
+
+
+async def iter_csv(chunks):
+    # A header row is required; empty cells are treated as missing values
+    header = None
+    records = Records()
+    reader = csv.reader(records)
+    async for record in iter_csv_records(chunks):
+        if not record.strip():
+            continue
+        records.pending.append(record)
+        values = next(reader)
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        yield {name: value for name, value in zip(header, values) if value != ""}
+
+
+def normalize(row: int, record) -> tuple:
+    if isinstance(record, str):
+        contact = ContactBase.model_validate_json(record)
+    else:
+        contact = ContactBase.model_validate(record)
+    # The contacts table requires both addresses even though the model
+    # defaults them to None
+    if contact.phone_number is None or contact.email_address is None:
+        raise ValueError("phone_number and email_address are required")
+    keys = address_keys(contact)
+    return (
+        row, contact.user_id, contact.name, contact.phone_number, contact.email_address,
+        keys["phone_key"], keys["email_key"]
+    )
+
+
+async def load(session: AsyncSession, records: list[tuple]):
+    connection = await session.connection()
+    raw = await connection.get_raw_connection()
+    if hasattr(raw.driver_connection, "copy_records_to_table"):
+        await raw.driver_connection.copy_records_to_table("contact_import", records=records, columns=COLUMNS)
+    else:
+        await session.exec(staging.insert(), params=[dict(zip(COLUMNS, record)) for record in records])
+
+
+async def merge_chunk(session: AsyncSession, records: list[tuple], summary: ImportSummary):
+    await session.run_sync(lambda sync_session: staging.create(sync_session.connection()))
+    await load(session, records)
+    unknown = (await session.exec(UNKNOWN_USERS)).scalars().all()
+    inserted = (await session.exec(MERGE)).all()
+    await session.commit()
+
+    for row in inserted:
+        invalidate_addresses("contacts", row)
+    for seq in unknown:
+        summary.error(seq, "User does not exist")
+    summary.inserted += len(inserted)
+    summary.skipped += len(records) - len(inserted) - len(unknown)
+
+
+async def import_contacts(session: AsyncSession, records) -> ImportSummary:
+    summary = ImportSummary()
+    chunk = []
+    async for record in records:
+        summary.rows += 1
+        try:
+            chunk.append(normalize(summary.rows, record))
+        except ValidationError as e:
+            summary.error(summary.rows, e.errors(include_url=False, include_context=False, include_input=False))
+        except ValueError as e:
+            summary.error(summary.rows, str(e))
+        if len(chunk) >= config.IMPORT_CHUNK_SIZE:
+            await merge_chunk(session, chunk, summary)
+            chunk = []
+    if chunk:
+        await merge_chunk(session, chunk, summary)
+    return summary
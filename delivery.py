@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import random
+from datetime import datetime, timedelta, timezone
+
+import httpx
+from sqlalchemy import update
+from sqlmodel import select
+
+import config
+import database
+import metrics
+import providers
+from ratelimit import RETRYABLE_STATUSES, retry_after
+from models.enums import DeliveryStatus
+from models.sql.messages import Message
+from models.sql.outbox import Outbox
+
+logger = logging.getLogger(__name__)
+
+workers: list[asyncio.Task] = []
+wakeup = asyncio.Event()
+
+
+def notify_workers():
+    wakeup.set()
+
+
+def backoff(attempts: int) -> float:
+    delay = min(config.OUTBOX_BACKOFF_MAX, config.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+async def claim_batch() -> list[Outbox]:
+    now = datetime.now(timezone.utc)
+    async with database.session_factory() as session:
+        rows = (await session.exec(
+            select(Outbox).where(
+                (Outbox.status == DeliveryStatus.queued) &
+                (Outbox.next_attempt_at <= now)
+            ).order_by(Outbox.next_attempt_at).limit(config.OUTBOX_BATCH_SIZE).with_for_update(skip_locked=True)
+        )).all()
+        # Claimed rows are leased rather than held locked during delivery. If
+        # the worker dies mid-delivery they become visible again once the lease
+        # runs out.
+        for row in rows:
+            row.attempts += 1
+            row.next_attempt_at = now + timedelta(seconds=config.OUTBOX_LEASE_SECONDS)
+            session.add(row)
+        await session.commit()
+        return list(rows)
+
+
+async def deliver(row: Outbox):
+    error = None
+    retryable = True
+    delay = backoff(row.attempts)
+    try:
+        response = await providers.post(row.provider, row.payload)
+        if response.status_code != 200:
+            error = f"{response.status_code}: {response.text}"
+            retryable = response.status_code in RETRYABLE_STATUSES
+            delay = max(delay, retry_after(response) or 0.0)
+    except httpx.RequestError as e:
+        error = f"{type(e).__name__}: {e}"
+
+    values = {"last_error": error}
+    if error is None:
+        values["status"] = DeliveryStatus.sent
+    elif not retryable or row.attempts >= config.OUTBOX_MAX_ATTEMPTS:
+        values["status"] = DeliveryStatus.failed
+    else:
+        values["next_attempt_at"] = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        metrics.provider_retries.inc(row.provider.name, error.split(":", 1)[0])
+
+    async with database.session_factory() as session:
+        await session.exec(update(Outbox).where(Outbox.id == row.id).values(**values))
+        if "status" in values:
+            await session.exec(
+                update(Message).where(Message.id == row.message_id).values(status=values["status"])
+            )
+        await session.commit()
+
+
+async def run_worker():
+    while True:
+        try:
+            rows = await claim_batch()
+            for row in rows:
+                await deliver(row)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Outbox delivery failed")
+            rows = []
+
+        if len(rows) < config.OUTBOX_BATCH_SIZE:
+            wakeup.clear()
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout=config.OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+
+async def start_workers():
+    for _ in range(config.OUTBOX_WORKERS - len(workers)):
+        workers.append(asyncio.create_task(run_worker()))
+
+
+async def stop_workers():
+    for task in workers:
+        task.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    workers.clear()
@@ -0,0 +1,20 @@
+import json
+
+from fastapi.responses import StreamingResponse
+
+import config
+import database
+
+
+async def stream_ndjson(statement):
+    # Runs on its own session: the response body is produced after the request
+    # dependencies have been torn down. yield_per makes asyncpg fetch through
+    # a server-side cursor, so memory stays flat whatever the row count.
+    async with database.session_factory() as session:
+        result = await session.stream(statement.execution_options(yield_per=config.EXPORT_YIELD_PER))
+        async for rows in result.partitions():
+            yield "".join(json.dumps(row._asdict(), default=str) + "\n" for row in rows).encode()
+
+
+def ndjson_response(statement):
+    return StreamingResponse(stream_ndjson(statement), media_type="application/x-ndjson")
@@ -0,0 +1,155 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from time import monotonic
+
+from fastapi import HTTPException
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+import database
+from models.sql.idempotency import IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+# Keys being executed by this process; local duplicates wait on the event
+# instead of polling the table
+in_flight: dict[str, asyncio.Event] = {}
+next_purge = 0.0
+
+
+def fingerprint(*parts) -> str:
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def lease_expiry() -> datetime:
+    return datetime.now(timezone.utc) + timedelta(seconds=config.IDEMPOTENCY_LOCK_TIMEOUT)
+
+
+async def claim(session: AsyncSession, key: str, request_fingerprint: str) -> str | None:
+    # Inserts the key as in flight and returns the token that owns it. A row
+    # that has expired, either a stored response past its TTL or an attempt
+    # whose lease was no longer renewed, is taken over.
+    now = datetime.now(timezone.utc)
+    statement = pg_insert(IdempotencyKey).values(
+        key=key,
+        fingerprint=request_fingerprint,
+        token=uuid.uuid4().hex,
+        expires_at=lease_expiry(),
+    )
+    statement = statement.on_conflict_do_update(
+        index_elements=["key"],
+        set_={
+            "fingerprint": statement.excluded.fingerprint,
+            "token": statement.excluded.token,
+            "status_code": None,
+            "response": None,
+            "expires_at": statement.excluded.expires_at,
+        },
+        where=IdempotencyKey.expires_at < now,
+    ).returning(IdempotencyKey.token)
+    token = (await session.exec(statement)).scalar()
+    await session.commit()
+    return token
+
+
+def owned(key: str, token: str):
+    return (IdempotencyKey.key == key) & (IdempotencyKey.token == token)
+
+
+async def renew(key: str, token: str):
+    # Keeps the lease of a running attempt from expiring, however long the
+    # provider takes (retries, Retry-After, rate limiting). Uses its own
+    # session as the request's is busy with the send.
+    while True:
+        await asyncio.sleep(config.IDEMPOTENCY_LOCK_TIMEOUT / 3)
+        try:
+            async with database.session_factory() as session:
+                renewed = (await session.exec(
+                    update(IdempotencyKey).where(owned(key, token)).values(expires_at=lease_expiry())
+                )).rowcount
+                await session.commit()
+        except Exception:
+            logger.exception("Renewing the lease on Idempotency-Key %s failed", key)
+            continue
+        if not renewed:
+            logger.warning("Lost the lease on Idempotency-Key %s", key)
+            return
+
+
+async def purge_expired(session: AsyncSession):
+    global next_purge
+    if monotonic() < next_purge:
+        return
+    next_purge = monotonic() + config.IDEMPOTENCY_PURGE_INTERVAL
+    await session.exec(delete(IdempotencyKey).where(IdempotencyKey.expires_at < datetime.now(timezone.utc)))
+    await session.commit()
+
+
+async def wait(key: str, deadline: float):
+    event = in_flight.get(key)
+    timeout = deadline - monotonic()
+    if event is None:
+        await asyncio.sleep(min(config.IDEMPOTENCY_POLL_INTERVAL, max(timeout, 0)))
+        return
+    try:
+        await asyncio.wait_for(event.wait(), timeout=max(timeout, 0))
+    except asyncio.TimeoutError:
+        pass
+
+
+async def execute(session: AsyncSession, key: str, request_fingerprint: str, run):
+    # Runs run() -> (status_code, json content) at most once per key and
+    # returns (status_code, content, replayed). Failed attempts release the key
+    # so the client can retry them.
+    await purge_expired(session)
+    deadline = monotonic() + config.IDEMPOTENCY_WAIT_TIMEOUT
+    while (token := await claim(session, key, request_fingerprint)) is None:
+        row = (await session.exec(
+            select(IdempotencyKey.fingerprint, IdempotencyKey.status_code, IdempotencyKey.response)
+            .where(IdempotencyKey.key == key)
+        )).first()
+        # Nothing is held open while waiting on another attempt
+        await session.rollback()
+        if row is None:
+            continue
+        if row.fingerprint != request_fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+        if row.status_code is not None:
+            return row.status_code, row.response, True
+        if monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+        await wait(key, deadline)
+
+    event = in_flight[key] = asyncio.Event()
+    renewal = asyncio.create_task(renew(key, token))
+    try:
+        try:
+            status_code, content = await run()
+        except BaseException:
+            await session.rollback()
+            await session.exec(delete(IdempotencyKey).where(owned(key, token)))
+            await session.commit()
+            raise
+        # Only stored while the claim is still ours
+        await session.exec(
+            update(IdempotencyKey).where(owned(key, token)).values(
+                status_code=status_code,
+                response=content,
+                expires_at=datetime.now(timezone.utc) + timedelta(seconds=config.IDEMPOTENCY_TTL),
+            )
+        )
+        await session.commit()
+        return status_code, content, False
+    finally:
+        renewal.cancel()
+        await asyncio.gather(renewal, return_exceptions=True)
+        if in_flight.get(key) is event:
+            del in_flight[key]
+        event.set()
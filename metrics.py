@@ -0,0 +1,175 @@
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+# Minimal in-process registry rendered in the Prometheus text format. Metrics
+# are plain dicts keyed by label values, cheap enough to update on every
+# request and every query.
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100, 250, 1000)
+
+registry = []
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = {}
+        registry.append(self)
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value: float, *labels):
+        self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            # Per-bucket (not cumulative) counts, then sum and count
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += bucket_count
+                le = f'le="{bound}"'
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {count}"
+
+
+def render() -> str:
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+http_requests_in_flight = Gauge("http_requests_in_flight", "Requests currently being served")
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Request latency by route", ("method", "route", "status")
+)
+db_queries_per_request = Histogram(
+    "db_queries_per_request", "Queries issued while serving a request", ("route",), buckets=COUNT_BUCKETS
+)
+db_query_seconds_per_request = Histogram(
+    "db_query_seconds_per_request", "Time spent in queries while serving a request", ("route",)
+)
+db_query_duration = Histogram("db_query_duration_seconds", "Latency of individual queries")
+db_pool_checkout_wait = Histogram("db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection")
+db_pool_checked_out = Gauge("db_pool_checked_out", "Connections currently checked out of the pool")
+db_pool_overflow = Gauge("db_pool_overflow", "Connections opened beyond pool_size")
+provider_request_duration = Histogram(
+    "provider_request_duration_seconds", "Provider call latency by provider and status", ("provider", "status")
+)
+provider_retries = Counter("provider_retries_total", "Provider calls retried, by the status that caused it", ("provider", "status"))
+provider_concurrency_limit = Gauge("provider_concurrency_limit", "Current adaptive concurrency limit", ("provider",))
+provider_in_flight = Gauge("provider_requests_in_flight", "Provider calls currently in flight", ("provider",))
+
+# [query count, query seconds] for the request being served, if any
+request_queries: ContextVar[list | None] = ContextVar("request_queries", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = perf_counter() - conn.info["query_started"].pop()
+    db_query_duration.observe(elapsed)
+    queries = request_queries.get()
+    if queries is not None:
+        queries[0] += 1
+        queries[1] += elapsed
+
+
+def handle_error(context):
+    # Failed statements never reach after_cursor_execute
+    started = context.connection.info.get("query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+class MetricsMiddleware:
+    # Plain ASGI middleware, so streaming responses are timed to their last
+    # chunk without buffering anything
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        queries = [0, 0.0]
+        token = request_queries.set(queries)
+        http_requests_in_flight.inc()
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = perf_counter() - started
+            http_requests_in_flight.dec()
+            request_queries.reset(token)
+            # The route template keeps label cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path_format", None) or "unmatched"
+            http_request_duration.observe(elapsed, scope["method"], path, status)
+            db_queries_per_request.observe(queries[0], path)
+            db_query_seconds_per_request.observe(queries[1], path)
@@ -0,0 +1,231 @@
+import logging
+
+from sqlalchemy import Enum, UniqueConstraint, text
+from sqlalchemy.schema import CreateColumn
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+import database
+import partitions
+import summaries
+from addresses import backfill
+
+logger = logging.getLogger(__name__)
+
+# Brings a database created by an earlier version up to the current models.
+# create_all only creates tables that are missing; the columns, indexes and
+# partitioning added to existing tables since are handled here. Every step
+# looks before it changes anything, so this runs on each start after
+# create_all (database.create_schema) and can be run again after a failure.
+
+# Held on its own connection while migrating, so that processes starting
+# together do not migrate at the same time
+LOCK = text("SELECT pg_advisory_lock(hashtext('migrations'))")
+UNLOCK = text("SELECT pg_advisory_unlock(hashtext('migrations'))")
+
+# Columns added to tables that already existed
+COLUMNS = [
+    ("messages", "status"),
+    ("messages", "provider_message_id"),
+    ("users", "phone_key"),
+    ("users", "email_key"),
+    ("contacts", "phone_key"),
+    ("contacts", "email_key"),
+    ("conversations", "last_message_at"),
+    ("conversations", "last_message_id"),
+    ("conversations", "last_message_preview"),
+    ("conversations", "message_count"),
+    ("conversations", "unread_count"),
+    ("conversations", "last_read_message_id"),
+    ("idempotency_keys", "token"),
+]
+# Value for existing rows of NOT NULL columns without a server default. Only
+# sent messages were stored before delivery status existed.
+EXISTING_ROWS = {
+    ("messages", "status"): "'sent'",
+}
+
+EXISTING_COLUMNS = text("""
+    SELECT table_name, column_name FROM information_schema.columns
+    WHERE table_schema = current_schema()
+""")
+
+# An address key may only be used once (per user for contacts); rows written
+# before that was enforced keep the key on the oldest row and lose it on the
+# others, which leaves those unreachable by inbound messages, as they were
+DUPLICATE_KEYS = """
+    UPDATE {table} AS t SET {column} = NULL
+    FROM {table} AS kept
+    WHERE kept.{column} = t.{column} AND kept.id < t.id {scope}
+"""
+
+# Conversations created twice by racing requests before get-or-create had a
+# unique key to conflict on are merged into the oldest one
+DUPLICATE_CONVERSATIONS = """
+    WITH kept AS (
+        SELECT id, min(id) OVER (PARTITION BY user_id, contact_id, type) AS kept_id FROM conversations
+    )
+"""
+MOVE_MESSAGES = text(DUPLICATE_CONVERSATIONS + """
+    UPDATE messages AS m SET conversation_id = kept.kept_id
+    FROM kept WHERE m.conversation_id = kept.id AND kept.id <> kept.kept_id
+""")
+DELETE_CONVERSATIONS = text(DUPLICATE_CONVERSATIONS + """
+    DELETE FROM conversations AS c USING kept WHERE c.id = kept.id AND kept.id <> kept.kept_id
+""")
+
+LEGACY_MESSAGES = "messages_unpartitioned"
+
+
+async def exists(session: AsyncSession, name: str) -> bool:
+    return (await session.exec(text("SELECT to_regclass(:name) IS NOT NULL"), params={"name": name})).scalar()
+
+
+def add_columns(connection, existing: set[tuple[str, str]]) -> list[tuple[str, str]]:
+    tables = {table for table, _ in existing}
+    added = []
+    for table, name in COLUMNS:
+        if table not in tables or (table, name) in existing:
+            continue
+        column = SQLModel.metadata.tables[table].c[name]
+        if isinstance(column.type, Enum):
+            column.type.create(connection, checkfirst=True)
+        spec = CreateColumn(column).compile(dialect=connection.dialect)
+        value = EXISTING_ROWS.get((table, name))
+        if value is None:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {spec}")
+        else:
+            connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {spec} DEFAULT {value}")
+            connection.exec_driver_sql(f"ALTER TABLE {table} ALTER COLUMN {name} DROP DEFAULT")
+        added.append((table, name))
+    return added
+
+
+def create_indexes(connection):
+    # Indexes and unique constraints of tables create_all did not create.
+    # Unnamed unique constraints get the name Postgres would have given them.
+    constraints = set(connection.exec_driver_sql(
+        "SELECT conname FROM pg_constraint WHERE connamespace = to_regnamespace(current_schema())"
+    ).scalars())
+    for table in SQLModel.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(connection, checkfirst=True)
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint):
+                continue
+            columns = [column.name for column in constraint.columns]
+            name = constraint.name or f"{table.name}_{'_'.join(columns)}_key"
+            if name in constraints:
+                continue
+            connection.exec_driver_sql(f"CREATE UNIQUE INDEX IF NOT EXISTS {name} ON {table.name} ({', '.join(columns)})")
+            connection.exec_driver_sql(f"ALTER TABLE {table.name} ADD CONSTRAINT {name} UNIQUE USING INDEX {name}")
+
+
+async def migrate_columns(session: AsyncSession):
+    existing = {(row.table_name, row.column_name) for row in (await session.exec(EXISTING_COLUMNS)).all()}
+    added = await session.run_sync(lambda sync_session: add_columns(sync_session.connection(), existing))
+    await session.commit()
+    for table, name in added:
+        logger.info("Added %s.%s", table, name)
+
+
+async def migrate_address_keys(session: AsyncSession):
+    from models.sql.contacts import Contact
+    from models.sql.user import User
+
+    # The unique indexes are created last, so a table whose keys were not
+    # filled in completely is picked up again
+    for model, index, scope in (
+        (User, "users_phone_key_key", ""),
+        (Contact, "uq_contacts_user_id_phone_key", "AND kept.user_id = t.user_id"),
+    ):
+        if await exists(session, index):
+            continue
+        updated, invalid = await backfill(session, model, config.ADDRESS_BACKFILL_BATCH_SIZE)
+        duplicates = 0
+        for column in ("phone_key", "email_key"):
+            duplicates += (await session.exec(text(
+                DUPLICATE_KEYS.format(table=model.__tablename__, column=column, scope=scope)
+            ))).rowcount
+        await session.commit()
+        logger.info(
+            "Filled address keys of %s %s: %s invalid, %s duplicate keys cleared",
+            updated, model.__tablename__, invalid, duplicates
+        )
+
+
+async def merge_conversations(session: AsyncSession):
+    if await exists(session, "uq_conversations_user_id_contact_id_type"):
+        return
+    await session.exec(MOVE_MESSAGES)
+    merged = (await session.exec(DELETE_CONVERSATIONS)).rowcount
+    await session.commit()
+    logger.info("Merged %s duplicate conversations", merged)
+
+
+async def partition_messages(session: AsyncSession):
+    # One transaction: the old table is renamed out of the way together with
+    # its indexes and id sequence, the partitioned one created, every month
+    # found in the old rows attached, and the rows copied with their ids
+    from models.sql.messages import Message
+
+    if await partitions.is_partitioned(session):
+        return
+    await session.exec(text(f"ALTER TABLE messages RENAME TO {LEGACY_MESSAGES}"))
+    # Constraints first, which renames the indexes behind them as well
+    constraints = (await session.exec(
+        text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:name)"),
+        params={"name": LEGACY_MESSAGES}
+    )).scalars().all()
+    for constraint in constraints:
+        await session.exec(text(
+            f"ALTER TABLE {LEGACY_MESSAGES} RENAME CONSTRAINT {constraint} TO {constraint[:49]}_unpartitioned"
+        ))
+    indexes = (await session.exec(
+        text("SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :name"),
+        params={"name": LEGACY_MESSAGES}
+    )).scalars().all()
+    for index in indexes:
+        if not index.endswith("_unpartitioned"):
+            await session.exec(text(f"ALTER INDEX {index} RENAME TO {index[:49]}_unpartitioned"))
+    await session.exec(text(f"ALTER SEQUENCE IF EXISTS messages_id_seq RENAME TO {LEGACY_MESSAGES}_id_seq"))
+    await session.run_sync(lambda sync_session: Message.__table__.create(sync_session.connection()))
+
+    await session.exec(text(f"CREATE TABLE {partitions.DEFAULT} PARTITION OF messages DEFAULT"))
+    months = (await session.exec(text(
+        f"SELECT DISTINCT 'messages_' || to_char(\"timestamp\" AT TIME ZONE 'UTC', 'YYYY_MM') FROM {LEGACY_MESSAGES}"
+    ))).scalars().all()
+    for name in sorted(months):
+        await partitions.attach(session, name)
+    columns = ", ".join(f'"{column.name}"' for column in Message.__table__.columns)
+    copied = (await session.exec(text(
+        f"INSERT INTO messages ({columns}) SELECT {columns} FROM {LEGACY_MESSAGES}"
+    ))).rowcount
+    await session.exec(text(
+        "SELECT setval(pg_get_serial_sequence('messages', 'id'), coalesce(max(id), 0) + 1, false) FROM messages"
+    ))
+    await session.exec(text(f"DROP TABLE {LEGACY_MESSAGES}"))
+    await session.commit()
+    logger.info("Partitioned messages: %s rows in %s monthly partitions", copied, len(months))
+
+
+async def migrate():
+    engine = database.init_engine()
+    async with engine.connect() as lock:
+        await lock.execute(LOCK)
+        try:
+            async with database.session_factory() as session:
+                await migrate_columns(session)
+                await migrate_address_keys(session)
+                await merge_conversations(session)
+                await partition_messages(session)
+                # Summaries are rebuilt from the messages once, before the
+                # inbox index that marks them as done
+                if not await exists(session, "ix_conversations_user_id_last_message_at_id"):
+                    await session.commit()
+                    logger.info("Rebuilt %s conversation summaries", await summaries.rebuild())
+                await session.run_sync(lambda sync_session: create_indexes(sync_session.connection()))
+                await session.commit()
+        finally:
+            await lock.execute(UNLOCK)
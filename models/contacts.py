@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+
+class ContactRead(BaseModel):
+    # Public view of a contact; the canonical address keys stay internal
+    id: int
+    user_id: int
+    name: str
+    phone_number: str | None = None
+    email_address: str | None = None
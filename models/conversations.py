@@ -0,0 +1,17 @@
+from datetime import datetime
+
+from pydantic import BaseModel
+
+from models.enums import ConversationType
+
+
+class ConversationRead(BaseModel):
+    id: int
+    contact_id: int
+    type: ConversationType
+    started_at: datetime
+    last_message_at: datetime | None = None
+    last_message_id: int | None = None
+    last_message_preview: str | None = None
+    message_count: int = 0
+    unread_count: int = 0
@@ -19,4 +19,10 @@ class MessageType(str, Enum):
     
 class ConversationType(str, Enum):
     text = "text"
-    email = "email"
\ No newline at end of file
+    email = "email"
+    
+class DeliveryStatus(str, Enum):
+    queued = "queued"
+    sent = "sent"
+    failed = "failed"
+    received = "received"
\ No newline at end of file
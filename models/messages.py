@@ -1,15 +1,15 @@
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Optional, List
 
-from pydantic_extra_types.phone_numbers import PhoneNumber
-from pydantic import EmailStr, BaseModel, AliasChoices
+from pydantic import BaseModel, AliasChoices
 from pydantic import Field as PydanticField
 
-from models.enums import Provider, TextMessageType, ConversationType, MessageType
+from addresses import Address
+from models.enums import Provider, TextMessageType, ConversationType, MessageType, DeliveryStatus
 
 class IncomingMessage(BaseModel):
-    source: PhoneNumber | EmailStr = PydanticField(alias="from", example="+18045551234")
-    destination: PhoneNumber | EmailStr = PydanticField(alias="to", example="+12016661234")
+    source: Address = PydanticField(alias="from", example="+18045551234")
+    destination: Address = PydanticField(alias="to", example="+12016661234")
     type: TextMessageType | None = PydanticField(default=None, example="sms", description="Type of text message (sms, mms) or None for email")
     messageProviderID: str = PydanticField(..., example="message-1", validation_alias=AliasChoices("messaging_provider_id", "xillio_id"))
     body: str = PydanticField(..., example="text message")
@@ -17,8 +17,8 @@ class IncomingMessage(BaseModel):
     timestamp: datetime = PydanticField(..., example="2024-11-01T14:00:00Z")
     
 class OutgoingText(BaseModel):
-    source: PhoneNumber | EmailStr = PydanticField(serialization_alias="from", example="+12016661234")
-    destination: PhoneNumber | EmailStr = PydanticField(serialization_alias="to", example="+18045551234")
+    source: Address = PydanticField(serialization_alias="from", example="+12016661234")
+    destination: Address = PydanticField(serialization_alias="to", example="+18045551234")
     type: TextMessageType = PydanticField(..., example="sms", description="Type of text message (sms, mms)")
     body: str = PydanticField(..., example="text message")
     attachment: Optional[List[str]] = PydanticField(None, example="null")
@@ -27,10 +27,49 @@ class OutgoingText(BaseModel):
         allow_population_by_field_name = True
     
 class OutgoingEmail(BaseModel):
-    source: PhoneNumber | EmailStr = PydanticField(serialization_alias="from", example="jane.doe@example.com")
-    destination: PhoneNumber | EmailStr = PydanticField(serialization_alias="to", example="john.smith@example.com")
+    source: Address = PydanticField(serialization_alias="from", example="jane.doe@example.com")
+    destination: Address = PydanticField(serialization_alias="to", example="john.smith@example.com")
     body: str = PydanticField(..., example="text message")
     attachment: Optional[List[str]] = PydanticField(None, example="null")
     
     class Config:
-        allow_population_by_field_name = True
\ No newline at end of file
+        allow_population_by_field_name = True
+    
+class MessageRead(BaseModel):
+    id: int
+    conversation_id: int | None
+    user_id: int
+    contact_id: int
+    message_type: MessageType
+    status: DeliveryStatus
+    content: str
+    timestamp: datetime
+    attachment: Optional[List[str]] = PydanticField(None, description="Only included when requested")
+
+class MessageSearchResult(MessageRead):
+    rank: float = PydanticField(..., description="Relevance, higher first")
+
+class MessageAccepted(BaseModel):
+    # What send and receive answer with by default
+    id: int
+    status: DeliveryStatus
+    conversation_id: int
+
+class SentMessageEcho(MessageAccepted):
+    # send with ?echo=true
+    message: MessageRead
+    provider_request: dict
+    provider_response: Any = None
+
+class ReceivedMessageEcho(MessageAccepted):
+    # receive with ?echo=true
+    message: IncomingMessage
+
+class BatchResult(BaseModel):
+    # One per item of a batch; errors carry status_code and detail instead of ids
+    index: int
+    status: DeliveryStatus | str
+    id: int | None = None
+    conversation_id: int | None = None
+    status_code: int | None = None
+    detail: Any = None
\ No newline at end of file
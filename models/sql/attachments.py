@@ -0,0 +1,12 @@
+from datetime import datetime
+from sqlmodel import Field, SQLModel
+
+
+class Attachment(SQLModel, table=True):
+    __tablename__ = "attachments"
+    # Hex SHA-256 of the content, which is stored under ATTACHMENT_DIR by it
+    id: str = Field(primary_key=True, max_length=64)
+    size: int
+    # As sent with the first upload of the content
+    content_type: str = Field(max_length=255)
+    created_at: datetime
@@ -1,4 +1,4 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index, text
 from pydantic_extra_types.phone_numbers import PhoneNumber
 from pydantic import EmailStr
 
@@ -13,4 +13,19 @@ class ContactBase(SQLModel):
 
 class Contact(ContactBase, table=True):
     __tablename__ = "contacts"
-    id: int = Field(default=None, primary_key=True)
\ No newline at end of file
+    __table_args__ = (
+        Index("ix_contacts_user_id_id", "user_id", "id"),
+        # Inbound messages are resolved on the canonical keys
+        Index("ix_contacts_phone_key", "phone_key"),
+        Index("ix_contacts_email_key", "email_key"),
+        # A user has at most one contact per address; imports and PUT /contacts
+        # racing each other are settled here
+        Index("uq_contacts_user_id_phone_key", "user_id", "phone_key", unique=True,
+              postgresql_where=text("phone_key IS NOT NULL")),
+        Index("uq_contacts_user_id_email_key", "user_id", "email_key", unique=True,
+              postgresql_where=text("email_key IS NOT NULL")),
+    )
+    id: int = Field(default=None, primary_key=True)
+    # Canonical forms of the addresses above, see addresses.py
+    phone_key: str | None = Field(default=None)
+    email_key: str | None = Field(default=None)
\ No newline at end of file
@@ -1,5 +1,5 @@
 from datetime import datetime
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, Index, UniqueConstraint, text
 from ..enums import ConversationType
 
 
@@ -9,8 +9,28 @@ class ConversationBase(SQLModel):
     contact_id: int = Field(foreign_key="contacts.id", ondelete="CASCADE", schema_extra={"examples": [1]})
     type: ConversationType = Field(..., schema_extra={"examples": ["text"]})
     started_at: datetime = Field(default=None)
+    last_message_at: datetime | None = Field(default=None)
+    # Inbox summary, kept up to date in the transaction that stores each message
+    # (see summaries.py, which can also rebuild it from the messages table)
+    last_message_id: int | None = Field(default=None)
+    last_message_preview: str | None = Field(default=None)
+    message_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    unread_count: int = Field(default=0, sa_column_kwargs={"server_default": "0"})
+    # Highest message id when the conversation was last marked read; received
+    # messages above it are unread
+    last_read_message_id: int | None = Field(default=None)
 
 
 class Conversation(ConversationBase, table=True):
     __tablename__ = "conversations"
+    __table_args__ = (
+        # One conversation per (user, contact, type); also the conflict target for get-or-create
+        UniqueConstraint("user_id", "contact_id", "type", name="uq_conversations_user_id_contact_id_type"),
+        Index("ix_conversations_contact_id", "contact_id"),
+        # Inbox listing: a user's conversations by last activity
+        Index(
+            "ix_conversations_user_id_last_message_at_id",
+            "user_id", text("last_message_at DESC NULLS LAST"), text("id DESC")
+        ),
+    )
     id: int = Field(default=None, primary_key=True)
\ No newline at end of file
@@ -0,0 +1,21 @@
+from datetime import datetime
+from typing import Any
+from sqlmodel import Field, SQLModel, Column, Index
+from sqlalchemy.dialects.postgresql import JSON
+
+
+class IdempotencyKey(SQLModel, table=True):
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
+    key: str = Field(primary_key=True, max_length=255)
+    # sha256 of the request the key was first used with
+    fingerprint: str = Field(max_length=64)
+    # Identifies the attempt holding the key; renewals and the final write
+    # only apply while it still matches
+    token: str | None = Field(default=None, max_length=32)
+    # Both stay NULL while the first request is still in flight
+    status_code: int | None = Field(default=None)
+    response: Any = Field(default=None, sa_column=Column(JSON))
+    expires_at: datetime
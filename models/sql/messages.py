@@ -1,8 +1,19 @@
 from datetime import datetime
 from typing import List
-from sqlmodel import Field, SQLModel, Column
+from sqlmodel import Field, SQLModel, Column, Index
+from sqlalchemy import func, literal_column, text
 from sqlalchemy.dialects.postgresql import JSON
-from ..enums import MessageType
+from ..enums import MessageType, DeliveryStatus
+import config
+
+# Queries must use the exact expression of ix_messages_content_search
+SEARCH_REGCONFIG = literal_column(f"'{config.SEARCH_CONFIG}'::regconfig")
+
+def search_document(content):
+    return func.to_tsvector(SEARCH_REGCONFIG, content)
+
+def search_query(query: str):
+    return func.websearch_to_tsquery(SEARCH_REGCONFIG, query)
 
 class MessageBase(SQLModel):
     __tablename__ = "messages"
@@ -11,9 +22,33 @@ class MessageBase(SQLModel):
     conversation_id: int | None = Field(default=None, foreign_key="conversations.id", ondelete="CASCADE", schema_extra={"examples": [None]})
     message_type: MessageType = Field(MessageType.sms, schema_extra={"examples": [MessageType.sms]})
     content: str = Field(..., schema_extra={"examples": ["Hello, This is a message!"]})
+    # Ids from POST /attachments/ on sent messages, provider references on received ones
     attachment: List[str] = Field(default_factory=list, sa_column=Column(JSON))
     timestamp: datetime = Field(..., schema_extra={"examples": [datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")]})
 
 class Message(MessageBase, table=True):
+    # Range partitioned by month on timestamp, see partitions.py. Unique keys
+    # must include the partition key, so the primary key is (id, timestamp)
+    # and nothing can hold a foreign key to messages.
     __tablename__ = "messages"
-    id: int = Field(default=None, primary_key=True)
+    __table_args__ = (
+        # History is read per conversation in (timestamp, id) order
+        Index("ix_messages_conversation_id_timestamp_id", "conversation_id", "timestamp", "id"),
+        Index("ix_messages_user_id", "user_id"),
+        Index("ix_messages_contact_id", "contact_id"),
+        # Only inbound messages carry a provider id; NULLs never conflict. The
+        # timestamp is only here because the partition key has to be, receive
+        # deduplicates on the provider id alone, see lock_provider_ids.
+        Index("uq_messages_provider_message_id", "provider_message_id", "timestamp", unique=True),
+        # Full-text search on content, see search_document
+        Index(
+            "ix_messages_content_search",
+            text(f"to_tsvector('{config.SEARCH_CONFIG}'::regconfig, content)"),
+            postgresql_using="gin"
+        ),
+        {"postgresql_partition_by": "RANGE (timestamp)"},
+    )
+    id: int = Field(default=None, primary_key=True, sa_column_kwargs={"autoincrement": True})
+    timestamp: datetime = Field(..., primary_key=True, schema_extra={"examples": [datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")]})
+    status: DeliveryStatus = Field(default=DeliveryStatus.sent)
+    provider_message_id: str | None = Field(default=None)
@@ -0,0 +1,22 @@
+from datetime import datetime
+from sqlmodel import Field, SQLModel, Column, Index, text
+from sqlalchemy.dialects.postgresql import JSON
+from ..enums import Provider, DeliveryStatus
+
+
+class Outbox(SQLModel, table=True):
+    __tablename__ = "outbox"
+    __table_args__ = (
+        # Workers only ever scan rows that are still waiting for delivery
+        Index("ix_outbox_queued_next_attempt_at", "next_attempt_at", postgresql_where=text("status = 'queued'")),
+    )
+    id: int = Field(default=None, primary_key=True)
+    # No foreign key, messages is partitioned; archival removes the rows instead
+    message_id: int = Field(unique=True)
+    provider: Provider
+    payload: dict = Field(default_factory=dict, sa_column=Column(JSON))
+    status: DeliveryStatus = Field(default=DeliveryStatus.queued)
+    attempts: int = Field(default=0)
+    next_attempt_at: datetime
+    last_error: str | None = Field(default=None)
+    created_at: datetime
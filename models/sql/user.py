@@ -13,3 +13,6 @@ class UserBase(SQLModel):
 class User(UserBase, table=True):
     __tablename__ = "users"
     id: int = Field(default=None, primary_key=True)
+    # Canonical forms of the addresses above, see addresses.py
+    phone_key: str | None = Field(default=None, unique=True)
+    email_key: str | None = Field(default=None, unique=True)
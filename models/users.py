@@ -0,0 +1,9 @@
+from pydantic import BaseModel
+
+
+class UserRead(BaseModel):
+    # Public view of a user; the canonical address keys stay internal
+    id: int
+    name: str
+    phone_number: str
+    email_address: str
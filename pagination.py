@@ -0,0 +1,41 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, Query
+
+import config
+
+
+def page_limit(limit: int = Query(config.PAGE_LIMIT_DEFAULT, ge=1, le=config.PAGE_LIMIT_MAX)):
+    return limit
+
+
+def encode_cursor(*values) -> str:
+    # Opaque keyset cursor; datetimes are tagged so they survive the round trip
+    encoded = [{"t": value.isoformat()} if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(encoded, separators=(",", ":")).encode()).decode()
+
+
+def decode_cursor(cursor: str, *types) -> list:
+    # One expected type per position, e.g. (datetime | None, int); a cursor
+    # that does not match is a client error, not a failed query
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        values = [datetime.fromisoformat(value["t"]) if isinstance(value, dict) else value for value in values]
+        for value, expected in zip(values, types):
+            if isinstance(value, bool) or not isinstance(value, expected):
+                raise TypeError(value)
+        return values
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def next_cursor(rows: list, limit: int, key) -> str | None:
+    # Callers fetch limit + 1 rows; the extra row only tells us there is a next page
+    if len(rows) <= limit:
+        return None
+    del rows[limit:]
+    return encode_cursor(*key(rows[-1]))
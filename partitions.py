@@ -0,0 +1,290 @@
+import asyncio
+import gzip
+import logging
+import os
+import re
+import shutil
+from datetime import datetime, timezone
+from pathlib import Path
+
+from sqlalchemy import text
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+import database
+
+logger = logging.getLogger(__name__)
+
+# messages is range partitioned on timestamp with one partition per calendar
+# month (UTC), named messages_YYYY_MM, plus messages_default for rows outside
+# every month that exists. Inserts and time-bounded reads are routed to the
+# matching months only. Old months are detached, written out as gzipped NDJSON
+# and dropped; restore() loads such a file and attaches it again.
+
+DEFAULT = "messages_default"
+NAME = re.compile(r"^messages_(\d{4})_(\d{2})$")
+
+# Serializes maintenance between processes; released at commit
+LOCK = text("SELECT pg_advisory_xact_lock(hashtext('messages_partitions'))")
+
+TABLES = text(r"""
+    SELECT relname, relispartition FROM pg_class
+    WHERE relnamespace = to_regnamespace(current_schema())
+      AND relkind = 'r'
+      AND (relname = 'messages_default' OR relname ~ '^messages_[0-9]{4}_[0-9]{2}$')
+""")
+
+task: asyncio.Task | None = None
+
+
+def month_start(moment: datetime) -> datetime:
+    return moment.astimezone(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(start: datetime, months: int) -> datetime:
+    years, month = divmod(start.month - 1 + months, 12)
+    return start.replace(year=start.year + years, month=month + 1)
+
+
+def partition_name(start: datetime) -> str:
+    return f"messages_{start:%Y_%m}"
+
+
+def partition_range(name: str) -> tuple[datetime, datetime]:
+    match = NAME.match(name)
+    if match is None:
+        raise ValueError(f"{name} is not a monthly messages partition")
+    start = datetime(int(match[1]), int(match[2]), 1, tzinfo=timezone.utc)
+    return start, add_months(start, 1)
+
+
+def in_range(name: str) -> str:
+    # Names and bounds are generated here, never taken from requests
+    start, end = partition_range(name)
+    return f"\"timestamp\" >= '{start.isoformat()}' AND \"timestamp\" < '{end.isoformat()}'"
+
+
+async def is_partitioned(session: AsyncSession) -> bool:
+    kind = (await session.exec(text("SELECT relkind::text FROM pg_class WHERE oid = to_regclass('messages')"))).scalar()
+    return kind == "p"
+
+
+async def list_tables(session: AsyncSession) -> dict[str, bool]:
+    # Partition table name -> whether it is currently attached
+    return {row.relname: row.relispartition for row in (await session.exec(TABLES)).all()}
+
+
+async def attach(session: AsyncSession, name: str):
+    start, end = partition_range(name)
+    await session.exec(text(f"CREATE TABLE IF NOT EXISTS {name} (LIKE messages INCLUDING DEFAULTS)"))
+    # Rows that went to the default partition while the month had none
+    await session.exec(text(
+        f"WITH moved AS (DELETE FROM {DEFAULT} WHERE {in_range(name)} RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ))
+    # With a matching CHECK in place ATTACH does not scan the table
+    await session.exec(text(f"ALTER TABLE {name} ADD CONSTRAINT {name}_bounds CHECK ({in_range(name)})"))
+    await session.exec(text(
+        f"ALTER TABLE messages ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+    await session.exec(text(f"ALTER TABLE {name} DROP CONSTRAINT {name}_bounds"))
+
+
+async def ensure_partitions(session: AsyncSession, now: datetime | None = None) -> list[str]:
+    # The current month and MESSAGE_PARTITIONS_AHEAD months after it
+    if not await is_partitioned(session):
+        logger.warning("messages is not a partitioned table, skipping partition maintenance")
+        return []
+    await session.exec(LOCK)
+    tables = await list_tables(session)
+    if DEFAULT not in tables:
+        await session.exec(text(f"CREATE TABLE {DEFAULT} PARTITION OF messages DEFAULT"))
+    current = month_start(now or datetime.now(timezone.utc))
+    created = []
+    for offset in range(config.MESSAGE_PARTITIONS_AHEAD + 1):
+        name = partition_name(add_months(current, offset))
+        if name not in tables:
+            await attach(session, name)
+            created.append(name)
+    await session.commit()
+    return created
+
+
+async def default_months(session: AsyncSession, cutoff: datetime) -> list[str]:
+    # Months before the cutoff that only have rows in the default partition
+    # (backdated or out of window timestamps when they were written)
+    return list((await session.exec(text(
+        f"SELECT DISTINCT 'messages_' || to_char(\"timestamp\", 'YYYY_MM') FROM {DEFAULT} "
+        f"WHERE \"timestamp\" < '{cutoff.isoformat()}'"
+    ))).scalars().all())
+
+
+async def export(session: AsyncSession, name: str, directory: Path) -> Path:
+    path = directory / f"{name}.ndjson.gz"
+    partial = directory / f"{name}.ndjson.gz.{os.getpid()}.part"
+    # A month archived again (rows that reached the default partition after
+    # its first archive) is appended to the earlier file as another gzip member
+    partial.unlink(missing_ok=True)
+    if path.exists():
+        await asyncio.to_thread(shutil.copyfile, path, partial)
+    result = await session.stream(
+        text(f"SELECT row_to_json(m)::text FROM {name} AS m ORDER BY m.id")
+        .execution_options(yield_per=config.EXPORT_YIELD_PER)
+    )
+    with gzip.open(partial, "at", encoding="utf-8") as file:
+        async for rows in result.partitions():
+            await asyncio.to_thread(file.write, "".join(row[0] + "\n" for row in rows))
+    await session.commit()
+    partial.replace(path)
+    return path
+
+
+async def archive(session: AsyncSession, now: datetime | None = None, directory: str | None = None) -> list[Path]:
+    # Months that ended more than MESSAGE_RETENTION_MONTHS ago. Each one is
+    # detached in its own short transaction, so writes to messages are only
+    # blocked for the detach itself, then exported and dropped. A month left
+    # detached by an interrupted run is picked up again.
+    if config.MESSAGE_RETENTION_MONTHS <= 0:
+        return []
+    cutoff = add_months(month_start(now or datetime.now(timezone.utc)), -config.MESSAGE_RETENTION_MONTHS)
+    directory = Path(directory or config.MESSAGE_ARCHIVE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    # Old months still in the default partition get a partition of their own
+    # (attach moves their rows) and are archived with the rest
+    await session.exec(LOCK)
+    tables = await list_tables(session)
+    if tables.get(DEFAULT):
+        for name in await default_months(session, cutoff):
+            if name not in tables:
+                await attach(session, name)
+                tables[name] = True
+    await session.commit()
+
+    archived = []
+    for name in sorted(name for name in tables if name != DEFAULT and partition_range(name)[1] <= cutoff):
+        await session.exec(LOCK)
+        attached = (await list_tables(session)).get(name)
+        if attached is None:
+            await session.commit()
+            continue
+        if attached:
+            await session.exec(text(f"ALTER TABLE messages DETACH PARTITION {name}"))
+        await session.commit()
+
+        path = await export(session, name, directory)
+
+        await session.exec(LOCK)
+        await session.exec(text(f"DELETE FROM outbox AS o USING {name} AS m WHERE o.message_id = m.id"))
+        await session.exec(text(f"DROP TABLE IF EXISTS {name}"))
+        await session.commit()
+        logger.info("Archived %s to %s", name, path)
+        archived.append(path)
+    return archived
+
+
+def read_lines(file, count: int) -> list[str]:
+    lines = []
+    for line in file:
+        if line.strip():
+            lines.append(line)
+            if len(lines) >= count:
+                break
+    return lines
+
+
+async def restore(session: AsyncSession, path: str) -> tuple[str, int, int]:
+    # Loads an archived month back and attaches it. Messages whose user,
+    # contact or conversation has been deleted since are left out, as the
+    # cascade would have removed them. Returns (partition, rows, skipped).
+    path = Path(path)
+    name = path.name.removesuffix(".ndjson.gz")
+    partition_range(name)
+
+    await session.exec(LOCK)
+    if name in await list_tables(session):
+        raise ValueError(f"{name} already exists")
+    await session.exec(text(f"CREATE TABLE {name} (LIKE messages INCLUDING DEFAULTS)"))
+    load = text(f"INSERT INTO {name} SELECT * FROM json_populate_recordset(NULL::{name}, CAST(:rows AS json))")
+    rows = 0
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        while lines := await asyncio.to_thread(read_lines, file, config.EXPORT_YIELD_PER):
+            await session.exec(load, params={"rows": "[" + ",".join(lines) + "]"})
+            rows += len(lines)
+    # A month whose archive run was interrupted after the export and then
+    # rerun has its rows in the file twice
+    rows -= (await session.exec(text(
+        f"DELETE FROM {name} AS a USING {name} AS b WHERE a.id = b.id AND a.ctid > b.ctid"
+    ))).rowcount
+    skipped = (await session.exec(text(f"""
+        DELETE FROM {name} AS m
+        WHERE NOT EXISTS (SELECT 1 FROM users AS u WHERE u.id = m.user_id)
+           OR NOT EXISTS (SELECT 1 FROM contacts AS c WHERE c.id = m.contact_id)
+           OR (m.conversation_id IS NOT NULL
+               AND NOT EXISTS (SELECT 1 FROM conversations AS v WHERE v.id = m.conversation_id))
+    """))).rowcount
+    await attach(session, name)
+    await session.commit()
+    return name, rows - skipped, skipped
+
+
+async def maintain():
+    async with database.session_factory() as session:
+        await ensure_partitions(session)
+        await archive(session)
+
+
+async def run_maintenance():
+    while True:
+        try:
+            await maintain()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Partition maintenance failed")
+        await asyncio.sleep(config.PARTITION_MAINTENANCE_INTERVAL)
+
+
+async def start_maintenance():
+    global task
+    # Partitions for the current month have to exist before the first insert
+    async with database.session_factory() as session:
+        await ensure_partitions(session)
+    if task is None:
+        task = asyncio.create_task(run_maintenance())
+
+
+async def stop_maintenance():
+    global task
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        task = None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of the messages table")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("ensure", help="Create the current and upcoming monthly partitions")
+    archive_command = commands.add_parser("archive", help="Archive and drop months past MESSAGE_RETENTION_MONTHS")
+    archive_command.add_argument("--directory", default=config.MESSAGE_ARCHIVE_DIR)
+    restore_command = commands.add_parser("restore", help="Load archived months back into messages")
+    restore_command.add_argument("paths", nargs="+")
+
+    async def main(args):
+        database.init_engine()
+        async with database.session_factory() as session:
+            if args.command == "ensure":
+                print(f"Created {', '.join(await ensure_partitions(session)) or 'no partitions'}")
+            elif args.command == "archive":
+                for path in await archive(session, directory=args.directory):
+                    print(f"Archived {path}")
+            else:
+                for path in args.paths:
+                    name, rows, skipped = await restore(session, path)
+                    print(f"Restored {name}: {rows} messages, {skipped} without a user, contact or conversation")
+        await database.dispose_engine()
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,181 @@
+import importlib.util
+import logging
+from time import perf_counter
+
+import httpx
+
+import config
+import metrics
+from models.enums import Provider
+from ratelimit import AdaptiveLimiter
+
+logger = logging.getLogger(__name__)
+
+# httpx only needs h2 installed for HTTP/2, it is never imported here
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class ProviderStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.pool_wait_seconds = 0.0
+        self.connect_seconds = 0.0
+        self.send_seconds = 0.0
+        self.max_pool_wait_seconds = 0.0
+        self.max_send_seconds = 0.0
+
+    def record(self, timing: "RequestTiming", failed: bool):
+        self.requests += 1
+        self.errors += int(failed)
+        self.pool_wait_seconds += timing.pool_wait
+        self.connect_seconds += timing.connect
+        self.send_seconds += timing.send
+        self.max_pool_wait_seconds = max(self.max_pool_wait_seconds, timing.pool_wait)
+        self.max_send_seconds = max(self.max_send_seconds, timing.send)
+
+    def as_dict(self):
+        requests = self.requests or 1
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_pool_wait_ms": self.pool_wait_seconds / requests * 1000,
+            "max_pool_wait_ms": self.max_pool_wait_seconds * 1000,
+            "avg_connect_ms": self.connect_seconds / requests * 1000,
+            "avg_send_ms": self.send_seconds / requests * 1000,
+            "max_send_ms": self.max_send_seconds * 1000,
+        }
+
+
+class RequestTiming:
+    # Splits a request into time spent waiting for a pooled connection, time
+    # spent opening a new one (TCP/TLS) and time on the wire, using httpcore's
+    # trace extension events.
+    def __init__(self):
+        self.started = perf_counter()
+        self.acquired = None
+        self.connect_started = None
+        self.connect = 0.0
+        self.finished = None
+
+    async def trace(self, event: str, info: dict):
+        now = perf_counter()
+        if self.acquired is None:
+            self.acquired = now
+        if event in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            self.connect_started = now
+        elif event in ("connection.connect_tcp.complete", "connection.start_tls.complete"):
+            self.connect += now - self.connect_started
+
+    def finish(self):
+        self.finished = perf_counter()
+        if self.acquired is None:
+            self.acquired = self.finished
+
+    @property
+    def pool_wait(self):
+        return self.acquired - self.started
+
+    @property
+    def send(self):
+        return self.finished - self.acquired - self.connect
+
+
+clients: dict[Provider, httpx.AsyncClient] = {}
+stats: dict[Provider, ProviderStats] = {}
+limiters: dict[Provider, AdaptiveLimiter] = {}
+
+
+def _build_client(provider: Provider) -> httpx.AsyncClient:
+    name = provider.name
+    http2 = config.provider_setting(name, "HTTP2", config.PROVIDER_HTTP2)
+    if http2 and not HTTP2_AVAILABLE:
+        logger.warning("HTTP/2 requested for provider %s but h2 is not installed, using HTTP/1.1", name)
+        http2 = False
+
+    limits = httpx.Limits(
+        max_connections=config.provider_setting(name, "MAX_CONNECTIONS", config.PROVIDER_MAX_CONNECTIONS),
+        max_keepalive_connections=config.provider_setting(
+            name, "MAX_KEEPALIVE_CONNECTIONS", config.PROVIDER_MAX_KEEPALIVE_CONNECTIONS
+        ),
+        keepalive_expiry=config.provider_setting(name, "KEEPALIVE_EXPIRY", config.PROVIDER_KEEPALIVE_EXPIRY),
+    )
+    timeout = httpx.Timeout(
+        connect=config.provider_setting(name, "CONNECT_TIMEOUT", config.PROVIDER_CONNECT_TIMEOUT),
+        read=config.provider_setting(name, "READ_TIMEOUT", config.PROVIDER_READ_TIMEOUT),
+        write=config.provider_setting(name, "WRITE_TIMEOUT", config.PROVIDER_WRITE_TIMEOUT),
+        pool=config.provider_setting(name, "POOL_TIMEOUT", config.PROVIDER_POOL_TIMEOUT),
+    )
+    return httpx.AsyncClient(http2=http2, limits=limits, timeout=timeout)
+
+
+def _build_limiter(provider: Provider) -> AdaptiveLimiter:
+    name = provider.name
+    return AdaptiveLimiter(
+        rate=config.provider_setting(name, "RATE_LIMIT", config.PROVIDER_RATE_LIMIT),
+        burst=config.provider_setting(name, "RATE_BURST", config.PROVIDER_RATE_BURST),
+        initial=config.provider_setting(name, "CONCURRENCY_INITIAL", config.PROVIDER_CONCURRENCY_INITIAL),
+        minimum=config.provider_setting(name, "CONCURRENCY_MIN", config.PROVIDER_CONCURRENCY_MIN),
+        maximum=config.provider_setting(name, "CONCURRENCY_MAX", config.PROVIDER_CONCURRENCY_MAX),
+        decrease=config.provider_setting(name, "CONCURRENCY_DECREASE", config.PROVIDER_CONCURRENCY_DECREASE),
+    )
+
+
+async def start_clients():
+    for provider in Provider:
+        if provider not in clients:
+            clients[provider] = _build_client(provider)
+            stats[provider] = ProviderStats()
+            limiters[provider] = _build_limiter(provider)
+
+
+async def close_clients():
+    while clients:
+        _, client = clients.popitem()
+        await client.aclose()
+
+
+def get_client(provider: Provider) -> httpx.AsyncClient:
+    client = clients.get(provider)
+    if client is None:
+        client = clients[provider] = _build_client(provider)
+        stats[provider] = ProviderStats()
+        limiters[provider] = _build_limiter(provider)
+    return client
+
+
+async def post(provider: Provider, payload: dict | bytes) -> httpx.Response:
+    # Single attempt; retrying is up to the caller (see ratelimit.retry_delay).
+    # Payloads already serialized to JSON bytes are sent as they are.
+    client = get_client(provider)
+    if isinstance(payload, bytes):
+        body = {"content": payload, "headers": {"Content-Type": "application/json"}}
+    else:
+        body = {"json": payload}
+    limiter = limiters[provider]
+    started = await limiter.acquire()
+    timing = RequestTiming()
+    response = None
+    try:
+        response = await client.post(provider.value, **body, extensions={"trace": timing.trace})
+        return response
+    finally:
+        timing.finish()
+        stats[provider].record(timing, response is None or response.status_code != 200)
+        metrics.provider_request_duration.observe(
+            timing.finished - timing.started, provider.name, response.status_code if response is not None else "error"
+        )
+        await limiter.release(started, response)
+
+
+def update_metrics():
+    for provider, limiter in limiters.items():
+        metrics.provider_concurrency_limit.set(int(limiter.limit), provider.name)
+        metrics.provider_in_flight.set(limiter.in_flight, provider.name)
+
+
+def provider_stats():
+    return {
+        provider.name: {**provider_stats.as_dict(), "limiter": limiters[provider].stats()}
+        for provider, provider_stats in stats.items()
+    }
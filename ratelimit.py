@@ -0,0 +1,113 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from time import monotonic
+
+import httpx
+
+import config
+
+# Statuses worth another attempt. Anything else that is not a 200, notably
+# other 4xx responses, will fail the same way again.
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+THROTTLED_STATUSES = {429, 503}
+
+
+def retry_after(response: httpx.Response) -> float | None:
+    # Retry-After is either a number of seconds or an HTTP date
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), config.PROVIDER_RETRY_AFTER_MAX)
+
+
+def retry_delay(response: httpx.Response, attempt: int) -> float:
+    # Full jitter, so clients that were throttled together do not come back
+    # together; the provider's Retry-After wins when it asks for longer
+    delay = random.uniform(0, min(config.PROVIDER_RETRY_MAX, config.PROVIDER_RETRY_BASE * 2 ** attempt))
+    return max(delay, retry_after(response) or 0.0)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = monotonic()
+
+    async def acquire(self):
+        # Takes a token up front and sleeps off the debt, which keeps waiters
+        # in arrival order without a lock
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        if self.tokens < 0:
+            await asyncio.sleep(-self.tokens / self.rate)
+
+
+class AdaptiveLimiter:
+    # AIMD concurrency limit in front of a provider, optionally behind a token
+    # bucket. Each success grows the limit by 1/limit (about +1 per window of
+    # requests), a 429/503 multiplies it by `decrease`. Retry-After pauses
+    # every request to the provider, not just the one that was throttled.
+    def __init__(self, rate: float, burst: int, initial: int, minimum: int, maximum: int, decrease: float):
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.min_limit = max(minimum, 1)
+        self.max_limit = max(maximum, self.min_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.decrease = decrease
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.throttled = 0
+        self.changed = asyncio.Condition()
+
+    async def acquire(self) -> float:
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        try:
+            pause = self.blocked_until - monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if self.bucket is not None:
+                await self.bucket.acquire()
+        except BaseException:
+            await self.release(monotonic(), None)
+            raise
+        return monotonic()
+
+    async def release(self, started: float, response: httpx.Response | None):
+        async with self.changed:
+            self.in_flight -= 1
+            if response is not None and response.status_code in THROTTLED_STATUSES:
+                self.throttled += 1
+                # Requests sent before the last decrease were part of the
+                # window that was already punished
+                if started >= self.last_decrease:
+                    self.limit = max(self.min_limit, self.limit * self.decrease)
+                    self.last_decrease = monotonic()
+                pause = retry_after(response)
+                if pause:
+                    self.blocked_until = max(self.blocked_until, monotonic() + pause)
+            elif response is not None and response.status_code == 200:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            self.changed.notify_all()
+
+    def stats(self):
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "throttled": self.throttled,
+            "paused_for_ms": max(self.blocked_until - monotonic(), 0.0) * 1000,
+            "rate_limit": self.bucket.rate if self.bucket is not None else None,
+        }
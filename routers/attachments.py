@@ -0,0 +1,68 @@
+from datetime import datetime, timezone
+
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import FileResponse
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import blobs
+import config
+from database import get_session
+from models.sql.attachments import Attachment
+
+router = APIRouter(
+    prefix="/attachments",
+    tags=["attachments"]
+)
+
+
+def describe(attachment: Attachment):
+    return {
+        "id": attachment.id,
+        "size": attachment.size,
+        "content_type": attachment.content_type,
+        "url": blobs.url_for(attachment.id),
+    }
+
+
+@router.post("/", status_code=201)
+async def upload_attachment(request: Request, session: AsyncSession = Depends(get_session)):
+    # The raw request body is the attachment. It is hashed while streamed to
+    # disk, and content that is already stored is not written twice.
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > config.ATTACHMENT_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Attachment exceeds {config.ATTACHMENT_MAX_SIZE} bytes")
+    try:
+        attachment_id, size, partial = await blobs.receive(request.stream())
+    except ValueError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+
+    content_type = request.headers.get("content-type") or "application/octet-stream"
+    try:
+        await session.exec(pg_insert(Attachment).values(
+            id=attachment_id,
+            size=size,
+            content_type=content_type[:255],
+            created_at=datetime.now(timezone.utc)
+        ).on_conflict_do_nothing())
+        await session.commit()
+        # The file only lands under its id once the row exists
+        await blobs.place(partial, attachment_id)
+    finally:
+        await blobs.discard(partial)
+    return describe(await session.get(Attachment, attachment_id))
+
+
+@router.api_route("/{attachment_id}", methods=["GET", "HEAD"])
+async def download_attachment(attachment_id: str, session: AsyncSession = Depends(get_session)):
+    # Served from disk in chunks with Range support; the content behind an id
+    # never changes, so it can be cached indefinitely
+    attachment = await session.get(Attachment, attachment_id) if blobs.is_id(attachment_id) else None
+    # A row without its file (restored database, removed by hand) is missing too
+    if attachment is None or not await blobs.exists(attachment_id):
+        raise HTTPException(status_code=404, detail="Attachment not found")
+    return FileResponse(
+        blobs.path_for(attachment_id),
+        media_type=attachment.content_type,
+        headers={"ETag": f'"{attachment_id}"', "Cache-Control": "public, max-age=31536000, immutable"}
+    )
@@ -1,8 +1,16 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from models.sql.contacts import Contact, ContactBase
+from models.contacts import ContactRead
 from database import get_session
+from cache import invalidate_addresses
+from addresses import address_keys
+from pagination import page_limit, decode_cursor, next_cursor
+from export import ndjson_response
+from contact_import import import_contacts, iter_csv, iter_ndjson
 
 router = APIRouter(
     prefix="/contacts",
@@ -10,17 +18,64 @@ router = APIRouter(
 )
 
 
-@router.put("/")
-async def create_contact(contact: ContactBase, session: Session = Depends(get_session)):
-    db_contact = Contact.model_validate(contact)
+@router.put("/", response_model=ContactRead)
+async def create_contact(contact: ContactBase, session: AsyncSession = Depends(get_session)):
+    db_contact = Contact.model_validate(contact, update=address_keys(contact))
     session.add(db_contact)
-    session.commit()
-    session.refresh(db_contact)
+    try:
+        await session.commit()
+    except IntegrityError as e:
+        await session.rollback()
+        if "uq_contacts_user_id_" not in str(e.orig):
+            raise
+        raise HTTPException(status_code=409, detail="The user already has a contact with this phone number or email address")
+    await session.refresh(db_contact)
+    invalidate_addresses("contacts", db_contact)
     return db_contact
 
-@router.get("/")
-async def read_contacts(session: Session = Depends(get_session)):
-    contacts = session.exec(select(Contact)).all()
-    if not contacts:
+def filter_contacts(statement, user_id: int | None):
+    if user_id is not None:
+        statement = statement.where(Contact.user_id == user_id)
+    return statement
+
+@router.get("/", response_model=List[ContactRead])
+async def read_contacts(
+    response: Response,
+    user_id: int | None = None,
+    cursor: str | None = None,
+    limit: int = Depends(page_limit),
+    session: AsyncSession = Depends(get_session)
+):
+    # Keyset paginated on id, see read_user
+    statement = filter_contacts(select(Contact), user_id)
+    if cursor is not None:
+        (after_id,) = decode_cursor(cursor, int)
+        statement = statement.where(Contact.id > after_id)
+    contacts = list((await session.exec(statement.order_by(Contact.id).limit(limit + 1))).all())
+    if not contacts and cursor is None:
         raise HTTPException(status_code=404, detail="No contacts found")
-    return contacts
\ No newline at end of file
+    if (next_page := next_cursor(contacts, limit, lambda row: (row.id,))) is not None:
+        response.headers["X-Next-Cursor"] = next_page
+    return contacts
+
+@router.get("/export")
+async def export_contacts(user_id: int | None = None):
+    return ndjson_response(filter_contacts(
+        select(Contact.id, Contact.user_id, Contact.name, Contact.phone_number, Contact.email_address),
+        user_id
+    ).order_by(Contact.id))
+
+@router.post("/import")
+async def import_contacts_stream(request: Request, session: AsyncSession = Depends(get_session)):
+    # Streamed CSV (with a header row) or NDJSON, loaded in chunks through a
+    # staging table and merged without duplicating (user_id, phone) or
+    # (user_id, email) pairs
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "text/csv":
+        records = iter_csv(request.stream())
+    elif content_type in ("application/x-ndjson", "application/jsonl"):
+        records = iter_ndjson(request.stream())
+    else:
+        raise HTTPException(status_code=415, detail="Expected text/csv or application/x-ndjson")
+    summary = await import_contacts(session, records)
+    return summary.as_dict()
\ No newline at end of file
@@ -0,0 +1,88 @@
+from datetime import datetime
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import func, tuple_, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from models.sql.conversations import Conversation
+from models.sql.messages import Message
+from models.messages import MessageRead
+from models.conversations import ConversationRead
+from models.pagination import Page
+from database import get_session
+from pagination import page_limit, decode_cursor, next_cursor
+
+router = APIRouter(
+    prefix="/conversations",
+    tags=["conversations"]
+)
+
+
+@router.get("/{conversation_id}/messages", response_model=Page[MessageRead])
+async def read_conversation_messages(
+    conversation_id: int,
+    cursor: str | None = None,
+    limit: int = Depends(page_limit),
+    attachments: bool = False,
+    session: AsyncSession = Depends(get_session)
+):
+    # Newest first, keyset paginated on (timestamp, id) so every page is a
+    # range scan of ix_messages_conversation_id_timestamp_id. The ordered scan
+    # reaches older monthly partitions only when the page needs them.
+    columns = [
+        Message.id,
+        Message.conversation_id,
+        Message.user_id,
+        Message.contact_id,
+        Message.message_type,
+        Message.status,
+        Message.content,
+        Message.timestamp,
+    ]
+    if attachments:
+        columns.append(Message.attachment)
+
+    statement = select(*columns).where(Message.conversation_id == conversation_id)
+    if cursor is not None:
+        timestamp, message_id = decode_cursor(cursor, datetime, int)
+        # The plain bound lets the planner prune partitions past the cursor
+        statement = statement.where(
+            (Message.timestamp <= timestamp) & (tuple_(Message.timestamp, Message.id) < (timestamp, message_id))
+        )
+    rows = (await session.exec(
+        statement.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1)
+    )).all()
+
+    if not rows and cursor is None and await session.get(Conversation, conversation_id) is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    cursor = next_cursor(rows, limit, lambda row: (row.timestamp, row.id))
+    return Page(items=[row._asdict() for row in rows], next_cursor=cursor)
+
+
+@router.post("/{conversation_id}/read", response_model=ConversationRead)
+async def mark_conversation_read(conversation_id: int, session: AsyncSession = Depends(get_session)):
+    # The watermark is the highest message id, the same comparison the
+    # rebuild uses: messages stored later get higher ids whatever their
+    # timestamp. Holding the row lock first means no message of this
+    # conversation is mid-insert (they lock the row before inserting), so the
+    # max() below sees all of them.
+    locked = (await session.exec(
+        select(Conversation.id).where(Conversation.id == conversation_id).with_for_update()
+    )).first()
+    if locked is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    watermark = (await session.exec(
+        select(func.max(Message.id)).where(Message.conversation_id == conversation_id)
+    )).one()
+    row = (await session.exec(
+        update(Conversation).where(Conversation.id == conversation_id).values(
+            unread_count=0,
+            last_read_message_id=watermark
+        ).returning(*(getattr(Conversation, field) for field in ConversationRead.model_fields))
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    await session.commit()
+    return row._asdict()
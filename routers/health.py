@@ -0,0 +1,25 @@
+from fastapi import APIRouter
+
+from database import pool_stats
+from providers import provider_stats
+from cache import cache_stats
+
+router = APIRouter(
+    prefix="/health",
+    tags=["health"]
+)
+
+
+@router.get("/db/pool")
+async def read_pool_stats():
+    return pool_stats()
+
+
+@router.get("/providers")
+async def read_provider_stats():
+    return provider_stats()
+
+
+@router.get("/cache")
+async def read_cache_stats():
+    return cache_stats()
@@ -1,225 +1,430 @@
-from asyncio import sleep
+from asyncio import sleep, gather, Semaphore
 from datetime import datetime, timezone
+from typing import Any, List
 import httpx
 
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy import exists, func, insert, text, tuple_
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from pydantic_extra_types.phone_numbers import PhoneNumber
-
-from models.sql.messages import Message, MessageBase
-from models.enums import Provider, TextMessageType, ConversationType
-from models.messages import IncomingMessage, OutgoingText, OutgoingEmail
+from models.sql.messages import Message, MessageBase, search_document, search_query
+from models.enums import Provider, TextMessageType, ConversationType, DeliveryStatus
+from models.messages import (
+    IncomingMessage, OutgoingText, OutgoingEmail, MessageRead, MessageSearchResult,
+    MessageAccepted, SentMessageEcho, ReceivedMessageEcho, BatchResult
+)
+from models.pagination import Page
 from models.sql.user import User
 from models.sql.contacts import Contact
 from models.sql.conversations import Conversation
+from models.sql.outbox import Outbox
+from models.sql.attachments import Attachment
 from database import get_session
+from pagination import page_limit, decode_cursor, next_cursor
+import blobs
+import config
+import providers
+import idempotency
+import metrics
+import stream
+from summaries import update_summaries
+from ratelimit import RETRYABLE_STATUSES, retry_delay
+from delivery import notify_workers
+from cache import MISSING, ids_by_address, addresses_by_id, received_messages
 
 router = APIRouter(
     prefix="/messages",
     tags=["messages"]
 )
 
-def get_conversation(session: Session, user_id: int, contact_id: int, conversation_type: ConversationType):
-    conversation = session.exec(
-        select(Conversation).where(
-            (Conversation.user_id == user_id) &
-            (Conversation.contact_id == contact_id) &
-            (Conversation.type == conversation_type)
-        )
-    ).first()
-    return conversation if conversation else None
+# Built once at import; serializing through them skips the per-call schema
+# walk of jsonable_encoder and model_dump + json.dumps
+OUTGOING = TypeAdapter(OutgoingText | OutgoingEmail)
+SEND_RESULT = TypeAdapter(SentMessageEcho | MessageAccepted)
 
-def get_user_phone_number(session: Session, user_id: int):
-    phone_number = session.exec(
-        select(User.phone_number).where(
-            (User.id == user_id)
-        )
-    ).first()
-    return phone_number if phone_number else None
+def upsert_conversations(activity: dict[tuple[int, int, ConversationType], datetime]):
+    # INSERT ... ON CONFLICT on the (user_id, contact_id, type) constraint. The
+    # update moves last_message_at forward, and makes RETURNING yield the id of
+    # rows that already existed, so a get-or-create is a single statement that
+    # is safe under concurrency.
+    started_at = datetime.now(timezone.utc)
+    statement = pg_insert(Conversation).values([
+        {
+            "user_id": user_id,
+            "contact_id": contact_id,
+            "type": conversation_type,
+            "started_at": started_at,
+            "last_message_at": activity[(user_id, contact_id, conversation_type)],
+        }
+        # Sorted so concurrent batches lock conversation rows in the same order
+        for user_id, contact_id, conversation_type in sorted(activity)
+    ])
+    return statement.on_conflict_do_update(
+        constraint="uq_conversations_user_id_contact_id_type",
+        set_={"last_message_at": func.greatest(Conversation.last_message_at, statement.excluded.last_message_at)}
+    ).returning(Conversation.id, Conversation.user_id, Conversation.contact_id, Conversation.type)
 
-def get_contact_phone_number(session: Session, contact_id: int):
-    phone_number = session.exec(
-        select(Contact.phone_number).where(
-            (Contact.id == contact_id)
-        )
-    ).first()
-    return phone_number if phone_number else None
+async def get_or_create_conversation(
+    session: AsyncSession,
+    user_id: int,
+    contact_id: int,
+    conversation_type: ConversationType,
+    last_message_at: datetime
+):
+    statement = upsert_conversations({(user_id, contact_id, conversation_type): last_message_at})
+    return (await session.exec(statement)).one().id
 
-def get_user_email_address(session: Session, user_id: int):
-    email_address = session.exec(
-        select(User.email_address).where(
-            (User.id == user_id)
-        )
-    ).first()
-    return email_address if email_address else None
+async def get_send_context(session: AsyncSession, user_id: int, contact_id: int, conversation_type: ConversationType):
+    # Everything send_message needs to validate and address a message, in a
+    # single round trip: the existing conversation, both addresses for the
+    # conversation type and whether the user and contact exist at all.
+    # Providers are addressed with the canonical keys.
+    if conversation_type is ConversationType.text:
+        user_address, contact_address = User.phone_key, Contact.phone_key
+    else:
+        user_address, contact_address = User.email_key, Contact.email_key
 
-def get_contact_email_address(session: Session, contact_id: int):
-    email_address = session.exec(
-        select(Contact.email_address).where(
-            (Contact.id == contact_id)
+    return (await session.exec(
+        select(
+            select(Conversation.id).where(
+                (Conversation.user_id == user_id) &
+                (Conversation.contact_id == contact_id) &
+                (Conversation.type == conversation_type)
+            ).limit(1).scalar_subquery().label("conversation_id"),
+            select(user_address).where(User.id == user_id).scalar_subquery().label("source"),
+            select(contact_address).where(Contact.id == contact_id).scalar_subquery().label("destination"),
+            exists().where(User.id == user_id).label("user_exists"),
+            exists().where(Contact.id == contact_id).label("contact_exists"),
         )
-    ).first()
-    return email_address if email_address else None
+    )).one()
 
-def get_user_id_by_phone(session: Session, phone_number: str):
-    user_id = session.exec(
+@ids_by_address.memoize("users.phone_key")
+async def get_user_id_by_phone(session: AsyncSession, phone_number: str):
+    user_id = (await session.exec(
         select(User.id).where(
-            (User.phone_number == phone_number)
+            (User.phone_key == phone_number)
         )
-    ).first()
+    )).first()
     return user_id if user_id else None
 
-def get_contact_id_by_phone(session: Session, phone_number: str):
-    contact_id = session.exec(
+@ids_by_address.memoize("contacts.phone_key")
+async def get_contact_id_by_phone(session: AsyncSession, user_phone_number: tuple[int, str]):
+    # Contacts belong to a user, so the same address may be a contact of
+    # several users; (user_id, phone_key) is unique
+    user_id, phone_number = user_phone_number
+    contact_id = (await session.exec(
         select(Contact.id).where(
-            (Contact.phone_number == phone_number)
+            (Contact.user_id == user_id) & (Contact.phone_key == phone_number)
         )
-    ).first()
+    )).first()
     return contact_id if contact_id else None
 
-def get_user_id_by_email(session: Session, email_address: str):
-    user_id = session.exec(
+@ids_by_address.memoize("users.email_key")
+async def get_user_id_by_email(session: AsyncSession, email_address: str):
+    user_id = (await session.exec(
         select(User.id).where(
-            (User.email_address == email_address)
+            (User.email_key == email_address)
         )
-    ).first()
+    )).first()
     return user_id if user_id else None
 
-def get_contact_id_by_email(session: Session, email_address: str):
-    contact_id = session.exec(
+@ids_by_address.memoize("contacts.email_key")
+async def get_contact_id_by_email(session: AsyncSession, user_email_address: tuple[int, str]):
+    user_id, email_address = user_email_address
+    contact_id = (await session.exec(
         select(Contact.id).where(
-            (Contact.email_address == email_address)
+            (Contact.user_id == user_id) & (Contact.email_key == email_address)
         )
-    ).first()
+    )).first()
     return contact_id if contact_id else None
 
-@router.post("/send")
+async def get_addresses_by_id(session: AsyncSession, model, column, ids: set[int]):
+    async def load(missing):
+        rows = (await session.exec(select(model.id, column).where(model.id.in_(missing)))).all()
+        return {row_id: address for row_id, address in rows}
 
-async def send_message(message: MessageBase, session: Session = Depends(get_session)):
-    source = None
-    destination = None
-    provider = None
-    conversation_type = None
-    outgoing = None
-    
-    if message.message_type in [TextMessageType.sms, TextMessageType.mms]:
-        provider = Provider.text
-        conversation_type = ConversationType.text
-    elif message.message_type == ConversationType.email:
-        provider = Provider.email
-        conversation_type = ConversationType.email
-    else:
-        raise HTTPException(status_code=404, detail="Invalid message type")
-    
-    conversation = get_conversation(
-        session, 
-        message.user_id, 
-        message.contact_id, 
-        conversation_type
-    )
+    return await addresses_by_id.get_many(f"{model.__tablename__}.{column.key}", ids, load)
 
-    if message.conversation_id is not None:
-        if conversation is None:
-            raise HTTPException(status_code=404, detail="Conversation id is incorrect or does not exist")
-        if conversation.type != conversation_type:
-            raise HTTPException(status_code=400, detail="Conversation type mismatch")
+async def get_unknown_attachments(session: AsyncSession, attachment_ids: set[str]):
+    # Sent messages reference attachments uploaded to /attachments/ by id
+    candidates = {attachment_id for attachment_id in attachment_ids if blobs.is_id(attachment_id)}
+    if not candidates:
+        return attachment_ids
+    found = (await session.exec(select(Attachment.id).where(Attachment.id.in_(candidates)))).all()
+    return attachment_ids - set(found)
 
-    if conversation_type is ConversationType.text:
-        source = get_user_phone_number(session, message.user_id)
-        destination = get_contact_phone_number(session, message.contact_id)
-    elif conversation_type is ConversationType.email:
-        source = get_user_email_address(session, message.user_id)
-        destination = get_contact_email_address(session, message.contact_id)
-        
-    if source is None:
-        raise HTTPException(status_code=404, detail="User does not exist")
-    if destination is None:
-        raise HTTPException(status_code=404, detail="Contact does not exist")
+async def get_conversation_ids(session: AsyncSession, keys: set[tuple[int, int, ConversationType]]):
+    # keys are (user_id, contact_id, type) triples
+    if not keys:
+        return {}
+    rows = (await session.exec(
+        select(Conversation.id, Conversation.user_id, Conversation.contact_id, Conversation.type).where(
+            tuple_(Conversation.user_id, Conversation.contact_id, Conversation.type).in_(keys)
+        )
+    )).all()
+    return {(row.user_id, row.contact_id, row.type): row.id for row in rows}
 
-    if conversation_type is ConversationType.text:
-        provider = Provider.text
-    elif conversation_type is ConversationType.email:
-        provider = Provider.email
-        
-    if provider is None:
-        raise HTTPException(status_code=404, detail="Invalid message type or provider not found")
+def latest_activity(pairs):
+    # (conversation key, timestamp) pairs -> latest timestamp per key
+    activity = {}
+    for key, timestamp in pairs:
+        if key not in activity or timestamp > activity[key]:
+            activity[key] = timestamp
+    return activity
+
+async def get_or_create_conversations(session: AsyncSession, activity: dict[tuple[int, int, ConversationType], datetime]):
+    if not activity:
+        return {}
+    rows = (await session.exec(upsert_conversations(activity))).all()
+    return {(row.user_id, row.contact_id, row.type): row.id for row in rows}
+
+async def insert_messages(session: AsyncSession, rows: list[dict]):
+    if not rows:
+        return []
+    return (await session.exec(
+        insert(Message).returning(Message.id, sort_by_parameter_order=True),
+        params=rows
+    )).scalars().all()
+
+async def get_user_ids_by_address(session: AsyncSession, column, addresses: set[str]):
+    async def load(missing):
+        rows = (await session.exec(select(User.id, column).where(column.in_(missing)))).all()
+        return {address: row_id for row_id, address in rows}
+
+    return await ids_by_address.get_many(f"users.{column.key}", addresses, load)
+
+async def get_contact_ids_by_address(session: AsyncSession, column, user_addresses: set[tuple[int, str]]):
+    # Same keys as the single-row resolvers: (user_id, address key) pairs
+    async def load(missing):
+        rows = (await session.exec(
+            select(Contact.id, Contact.user_id, column).where(tuple_(Contact.user_id, column).in_(missing))
+        )).all()
+        return {(user_id, address): row_id for row_id, user_id, address in rows}
+
+    return await ids_by_address.get_many(f"contacts.{column.key}", user_addresses, load)
+
+# Held until commit or rollback. The unique index has to include the partition
+# key, so on its own it lets through a redelivery that carries a different
+# timestamp; taking these locks before find_received makes the lookup see any
+# copy a concurrent request stored. Hashes are locked in order so that two
+# batches cannot deadlock on each other.
+LOCK_PROVIDER_IDS = text(
+    "SELECT pg_advisory_xact_lock(h) FROM ("
+    "SELECT DISTINCT hashtext(id) AS h FROM unnest(CAST(:ids AS text[])) AS id ORDER BY h"
+    ") ordered"
+)
 
+async def lock_provider_ids(session: AsyncSession, provider_ids: set[str]):
+    if provider_ids:
+        await session.exec(LOCK_PROVIDER_IDS, params={"ids": list(provider_ids)})
+
+async def find_received(session: AsyncSession, provider_ids: set[str]):
+    # provider message id -> (message id, conversation id) for inbound messages
+    # that are already stored
+    async def load(missing):
+        rows = (await session.exec(
+            select(Message.provider_message_id, Message.id, Message.conversation_id)
+            .where(Message.provider_message_id.in_(missing))
+        )).all()
+        return {row.provider_message_id: (row.id, row.conversation_id) for row in rows}
+
+    return await received_messages.get_many("messages.provider_message_id", provider_ids, load)
+
+async def insert_received(session: AsyncSession, rows: list[dict]):
+    # Rows whose provider id is already stored are skipped by the unique index;
+    # only the ones actually inserted come back
+    if not rows:
+        return {}
+    inserted = (await session.exec(
+        pg_insert(Message).on_conflict_do_nothing(index_elements=["provider_message_id", "timestamp"])
+        .returning(Message.provider_message_id, Message.id, Message.conversation_id),
+        params=rows
+    )).all()
+    return {row.provider_message_id: (row.id, row.conversation_id) for row in inserted}
+
+def remember_received(inserted: dict[str, tuple[int, int]]):
+    for provider_id, result in inserted.items():
+        received_messages.set(("messages.provider_message_id", provider_id), result)
+
+def resolve_message_type(message_type):
+    if message_type in [TextMessageType.sms, TextMessageType.mms]:
+        return Provider.text, ConversationType.text
+    if message_type == ConversationType.email:
+        return Provider.email, ConversationType.email
+    return None, None
+
+def build_outgoing(message: MessageBase, conversation_type: ConversationType, source: str, destination: str):
     if conversation_type is ConversationType.text:
-        outgoing = OutgoingText(
-            source=PhoneNumber(source),
-            destination=PhoneNumber(destination),
-            type=message.message_type,
-            body=message.content,
-            attachment=message.attachment or [],
-        )
-    elif conversation_type is ConversationType.email:
-        outgoing = OutgoingEmail(
+        return OutgoingText(
             source=source,
             destination=destination,
+            type=message.message_type,
             body=message.content,
-            attachment=message.attachment or [],
+            attachment=[blobs.url_for(attachment_id) for attachment_id in message.attachment or []],
+        )
+    return OutgoingEmail(
+        source=source,
+        destination=destination,
+        body=message.content,
+        attachment=[blobs.url_for(attachment_id) for attachment_id in message.attachment or []],
+    )
+
+async def dispatch(provider: Provider, outgoing: OutgoingText | OutgoingEmail) -> httpx.Response:
+    # Returns the last provider response; httpx.RequestError is left to the caller.
+    # Only throttling and server errors are retried, other 4xx fail fast.
+    payload = OUTGOING.dump_json(outgoing, by_alias=True, exclude_none=True)
+    for attempt in range(config.PROVIDER_MAX_ATTEMPTS):
+        response = await providers.post(provider, payload)
+        if response.status_code not in RETRYABLE_STATUSES or attempt == config.PROVIDER_MAX_ATTEMPTS - 1:
+            break
+        metrics.provider_retries.inc(provider.name, response.status_code)
+        await sleep(retry_delay(response, attempt))
+    return response
+
+def send_result(db_message: Message, echo: bool, provider_request: dict, provider_response: Any = None):
+    if not echo:
+        return MessageAccepted(id=db_message.id, status=db_message.status, conversation_id=db_message.conversation_id)
+    return SentMessageEcho(
+        id=db_message.id,
+        status=db_message.status,
+        conversation_id=db_message.conversation_id,
+        message=MessageRead.model_validate(db_message, from_attributes=True),
+        provider_request=provider_request,
+        provider_response=provider_response,
+    )
+
+async def send(message: MessageBase, http_response: Response, deferred: bool, echo: bool, session: AsyncSession):
+    provider, conversation_type = resolve_message_type(message.message_type)
+    if conversation_type is None:
+        raise HTTPException(status_code=404, detail="Invalid message type")
+
+    context = await get_send_context(session, message.user_id, message.contact_id, conversation_type)
+
+    if message.conversation_id is not None and context.conversation_id is None:
+        raise HTTPException(status_code=404, detail="Conversation id is incorrect or does not exist")
+    if not context.user_exists:
+        raise HTTPException(status_code=404, detail="User does not exist")
+    if not context.contact_exists:
+        raise HTTPException(status_code=404, detail="Contact does not exist")
+    address_kind = "phone number" if conversation_type is ConversationType.text else "email address"
+    if context.source is None:
+        raise HTTPException(status_code=404, detail=f"User has no {address_kind}")
+    if context.destination is None:
+        raise HTTPException(status_code=404, detail=f"Contact has no {address_kind}")
+    if message.attachment and (unknown := await get_unknown_attachments(session, set(message.attachment))):
+        raise HTTPException(status_code=422, detail=f"Unknown attachments: {', '.join(sorted(unknown))}")
+
+    outgoing = build_outgoing(message, conversation_type, context.source, context.destination)
+
+    if deferred:
+        # Store the message and its outbox entry in one transaction and let the
+        # delivery workers talk to the provider
+        conversation_id = await get_or_create_conversation(
+            session, message.user_id, message.contact_id, conversation_type, message.timestamp
         )
+        db_message = Message.model_validate(
+            message, update={"conversation_id": conversation_id, "status": DeliveryStatus.queued}
+        )
+        session.add(db_message)
+        await session.flush()
+        await update_summaries(session, [db_message.model_dump()])
+        now = datetime.now(timezone.utc)
+        payload = OUTGOING.dump_python(outgoing, mode="json", by_alias=True, exclude_none=True)
+        session.add(Outbox(
+            message_id=db_message.id,
+            provider=provider,
+            payload=payload,
+            next_attempt_at=now,
+            created_at=now
+        ))
+        await session.commit()
+        notify_workers()
+        http_response.status_code = 202
+        return send_result(db_message, echo, payload)
 
     try:
-        attempt = 0
-        while attempt < 3:
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        provider.value,
-                        json=outgoing.model_dump(by_alias=True, exclude_none=True)
-                    )
-                    if response.status_code == 200:
-                        break
-                    else:
-                        raise HTTPException(
-                            status_code=response.status_code,
-                            detail=f"Failed to send message: {response.text}"
-                        )
-            except HTTPException as e:
-                attempt = attempt + 1
-                await sleep(0.25 * 2 ** attempt)
-        
+        response = await dispatch(provider, outgoing)
+
         if response.status_code == 200:
-            if message.conversation_id is None and conversation is None:
-                conversation = Conversation(
-                    user_id=message.user_id,
-                    contact_id=message.contact_id,
-                    type=conversation_type,
-                    started_at=datetime.now(timezone.utc)
-                )
-                session.add(conversation)
-                session.commit()
-                session.refresh(conversation)
-                message.conversation_id = conversation.id
-            
-            db_message = Message.model_validate(message)
+            conversation_id = await get_or_create_conversation(
+                session, message.user_id, message.contact_id, conversation_type, message.timestamp
+            )
+            db_message = Message.model_validate(message, update={"conversation_id": conversation_id})
             session.add(db_message)
-            session.commit()
-            session.refresh(db_message)
-            return [db_message, outgoing.model_dump(), response.json()]
+            await session.flush()
+            await update_summaries(session, [db_message.model_dump()])
+            await session.commit()
+            if not echo:
+                return send_result(db_message, echo, None)
+            return send_result(
+                db_message, echo, OUTGOING.dump_python(outgoing, mode="json", by_alias=True, exclude_none=True), response.json()
+            )
         else:
             raise HTTPException(status_code=response.status_code, detail=f"Failed to send message: {response.text}")
     except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"Failed to send message: {e}") from e
 
-@router.post("/receive")
-async def receive(incoming: IncomingMessage, session: Session = Depends(get_session)):
-    
+@router.post("/send", response_model=SentMessageEcho | MessageAccepted)
+async def send_message(
+    message: MessageBase,
+    http_response: Response,
+    deferred: bool = config.MESSAGES_SEND_DEFERRED,
+    echo: bool = Query(False, description="Also return the stored message and the provider exchange"),
+    idempotency_key: str | None = Header(default=None, max_length=255),
+    session: AsyncSession = Depends(get_session)
+):
+    if idempotency_key is None:
+        return await send(message, http_response, deferred, echo, session)
+
+    # A retried request with the same key gets the stored response and never
+    # reaches the provider again; duplicates arriving while the first attempt
+    # is running wait for its result
+    async def run():
+        content = SEND_RESULT.dump_python(await send(message, http_response, deferred, echo, session), mode="json")
+        return http_response.status_code or 200, content
+
+    status_code, content, replayed = await idempotency.execute(
+        session,
+        idempotency_key,
+        idempotency.fingerprint("send", message.model_dump(mode="json"), deferred, echo),
+        run
+    )
+    headers = {"Idempotent-Replayed": "true"} if replayed else None
+    return JSONResponse(content, status_code=status_code, headers=headers)
+
+def receive_result(incoming: IncomingMessage, echo: bool, message_id: int, conversation_id: int):
+    if echo:
+        return ReceivedMessageEcho(
+            id=message_id, status=DeliveryStatus.received, conversation_id=conversation_id, message=incoming
+        )
+    return MessageAccepted(id=message_id, status=DeliveryStatus.received, conversation_id=conversation_id)
+
+@router.post("/receive", response_model=ReceivedMessageEcho | MessageAccepted)
+async def receive(
+    incoming: IncomingMessage,
+    echo: bool = Query(False, description="Also return the received message"),
+    session: AsyncSession = Depends(get_session)
+):
+    # Provider retries of a message we already stored get the original answer
+    stored = received_messages.get(("messages.provider_message_id", incoming.messageProviderID))
+    if stored is not MISSING:
+        return receive_result(incoming, echo, *stored)
+
     conversation_type = None
     message_type = None
-    conversation_id = None
 
     if incoming.type not in [TextMessageType.sms, TextMessageType.mms]:
-        user_id = get_user_id_by_email(session, incoming.destination)
-        contact_id = get_contact_id_by_email(session, incoming.source)
+        user_id = await get_user_id_by_email(session, incoming.destination)
+        contact_id = user_id and await get_contact_id_by_email(session, (user_id, incoming.source))
         conversation_type = ConversationType.email
         message_type = ConversationType.email
     else:
-        user_id = get_user_id_by_phone(session, incoming.destination)
-        contact_id = get_contact_id_by_phone(session, incoming.source)
+        user_id = await get_user_id_by_phone(session, incoming.destination)
+        contact_id = user_id and await get_contact_id_by_phone(session, (user_id, incoming.source))
         conversation_type = ConversationType.text
         message_type = incoming.type
 
@@ -228,35 +433,369 @@ async def receive(incoming: IncomingMessage, session: Session = Depends(get_sess
         raise HTTPException(status_code=404, detail=f"No user associated with destination {incoming.destination}")
     if contact_id is None:
         raise HTTPException(status_code=404, detail=f"No contact associated with source {incoming.source}")
-    
-    conversation = get_conversation(
-        session, 
-        user_id, 
-        contact_id, 
-        conversation_type
+
+    # Missed by the cache: stored earlier, possibly with another timestamp, or
+    # by a request still in flight
+    await lock_provider_ids(session, {incoming.messageProviderID})
+    found = await find_received(session, {incoming.messageProviderID})
+    if found:
+        await session.rollback()
+        return receive_result(incoming, echo, *found[incoming.messageProviderID])
+
+    conversation_id = await get_or_create_conversation(
+        session, user_id, contact_id, conversation_type, incoming.timestamp
     )
-    
-    if conversation is None:
-        conversation = Conversation(user_id=user_id, contact_id=contact_id, type=ConversationType.text, started_at=datetime.utcnow())
-        session.add(conversation)
-        session.commit()
-        session.refresh(conversation)
-        conversation_id = conversation.id
+
+    row = {
+        "user_id": user_id,
+        "contact_id": contact_id,
+        "conversation_id": conversation_id,
+        "message_type": message_type,
+        "content": incoming.body,
+        "attachment": incoming.attachment or [],
+        "timestamp": incoming.timestamp,
+        "status": DeliveryStatus.received,
+        "provider_message_id": incoming.messageProviderID,
+    }
+    inserted = await insert_received(session, [row])
+    if not inserted:
+        # The lock above covers this service's writers; the unique index has
+        # the last word for anything else
+        await session.rollback()
+        found = await find_received(session, {incoming.messageProviderID})
+        return receive_result(incoming, echo, *found[incoming.messageProviderID])
+
+    stored = [{**row, "id": inserted[incoming.messageProviderID][0]}]
+    await update_summaries(session, stored)
+    await stream.publish(session, stored)
+    await session.commit()
+    remember_received(inserted)
+    return receive_result(incoming, echo, *inserted[incoming.messageProviderID])
+
+
+@router.get("/{message_id}/status")
+async def read_message_status(message_id: int, session: AsyncSession = Depends(get_session)):
+    row = (await session.exec(
+        select(Message.id, Message.status, Outbox.attempts, Outbox.last_error, Outbox.next_attempt_at)
+        .outerjoin(Outbox, Outbox.message_id == Message.id)
+        .where(Message.id == message_id)
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    return {
+        "id": row.id,
+        "status": row.status,
+        "attempts": row.attempts or 0,
+        "last_error": row.last_error,
+        "next_attempt_at": row.next_attempt_at if row.status is DeliveryStatus.queued else None,
+    }
+
+@router.get("/search", response_model=Page[MessageSearchResult])
+async def search_messages(
+    user_id: int,
+    q: str = Query(min_length=1, max_length=config.SEARCH_QUERY_MAX_LENGTH, description="Web search syntax: words, \"phrases\", or, -exclude"),
+    contact_id: int | None = None,
+    conversation_id: int | None = None,
+    cursor: str | None = None,
+    limit: int = Depends(page_limit),
+    session: AsyncSession = Depends(get_session)
+):
+    # Matches come from the GIN index on the search document, narrowed to the
+    # user's messages. Most relevant first, keyset paginated on (rank, id).
+    query = search_query(q)
+    document = search_document(Message.content)
+    rank = func.ts_rank_cd(document, query)
+    statement = select(
+        Message.id,
+        Message.conversation_id,
+        Message.user_id,
+        Message.contact_id,
+        Message.message_type,
+        Message.status,
+        Message.content,
+        Message.timestamp,
+        rank.label("rank")
+    ).where((Message.user_id == user_id) & document.bool_op("@@")(query))
+    if contact_id is not None:
+        statement = statement.where(Message.contact_id == contact_id)
+    if conversation_id is not None:
+        statement = statement.where(Message.conversation_id == conversation_id)
+    if cursor is not None:
+        after_rank, after_id = decode_cursor(cursor, float | int, int)
+        statement = statement.where(tuple_(rank, Message.id) < (after_rank, after_id))
+    rows = (await session.exec(statement.order_by(rank.desc(), Message.id.desc()).limit(limit + 1))).all()
+
+    if not rows and cursor is None and await session.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    cursor = next_cursor(rows, limit, lambda row: (row.rank, row.id))
+    return Page(items=[row._asdict() for row in rows], next_cursor=cursor)
+
+def batch_error(index: int, status_code: int, detail: str):
+    return {"index": index, "status": "error", "status_code": status_code, "detail": detail}
+
+@router.post("/send/batch", response_model=List[BatchResult], response_model_exclude_none=True)
+async def send_messages(
+    messages: List[MessageBase],
+    http_response: Response,
+    deferred: bool = config.MESSAGES_SEND_DEFERRED,
+    session: AsyncSession = Depends(get_session)
+):
+    if len(messages) > config.MESSAGES_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {config.MESSAGES_BATCH_MAX_SIZE} messages")
+
+    results = [None] * len(messages)
+    routes = [resolve_message_type(message.message_type) for message in messages]
+    texts = [message for message, (_, conversation_type) in zip(messages, routes) if conversation_type is ConversationType.text]
+    emails = [message for message, (_, conversation_type) in zip(messages, routes) if conversation_type is ConversationType.email]
+    user_phones = await get_addresses_by_id(session, User, User.phone_key, {m.user_id for m in texts})
+    user_emails = await get_addresses_by_id(session, User, User.email_key, {m.user_id for m in emails})
+    contact_phones = await get_addresses_by_id(session, Contact, Contact.phone_key, {m.contact_id for m in texts})
+    contact_emails = await get_addresses_by_id(session, Contact, Contact.email_key, {m.contact_id for m in emails})
+    conversations = await get_conversation_ids(session, {
+        (message.user_id, message.contact_id, conversation_type)
+        for message, (_, conversation_type) in zip(messages, routes)
+        if conversation_type is not None
+    })
+    unknown_attachments = await get_unknown_attachments(session, {
+        attachment_id for message in messages for attachment_id in message.attachment or []
+    })
+
+    # (index, conversation key, provider, outgoing) for every item that passed validation
+    pending = []
+    for index, (message, (provider, conversation_type)) in enumerate(zip(messages, routes)):
+        if conversation_type is None:
+            results[index] = batch_error(index, 404, "Invalid message type")
+            continue
+        key = (message.user_id, message.contact_id, conversation_type)
+        if message.conversation_id is not None and key not in conversations:
+            results[index] = batch_error(index, 404, "Conversation id is incorrect or does not exist")
+            continue
+
+        if conversation_type is ConversationType.text:
+            source = user_phones.get(message.user_id)
+            destination = contact_phones.get(message.contact_id)
+        else:
+            source = user_emails.get(message.user_id)
+            destination = contact_emails.get(message.contact_id)
+        if source is None:
+            results[index] = batch_error(index, 404, "User does not exist")
+            continue
+        if destination is None:
+            results[index] = batch_error(index, 404, "Contact does not exist")
+            continue
+        if unknown := unknown_attachments.intersection(message.attachment or []):
+            results[index] = batch_error(index, 422, f"Unknown attachments: {', '.join(sorted(unknown))}")
+            continue
+
+        pending.append((index, key, provider, build_outgoing(message, conversation_type, source, destination)))
+
+    if deferred:
+        accepted = pending
     else:
-        conversation_id = conversation.id
-    
-    message = Message(
-        user_id=user_id,
-        contact_id=contact_id,
-        conversation_id=conversation_id,
-        message_type=message_type,
-        content=incoming.body,
-        attachment=incoming.attachment or [],
-        timestamp=incoming.timestamp
+        semaphore = Semaphore(config.MESSAGES_BATCH_CONCURRENCY)
+
+        async def send_one(item):
+            index, _, provider, outgoing = item
+            async with semaphore:
+                try:
+                    response = await dispatch(provider, outgoing)
+                except httpx.RequestError as e:
+                    results[index] = batch_error(index, 500, f"Failed to send message: {e}")
+                    return None
+            if response.status_code != 200:
+                results[index] = batch_error(index, response.status_code, f"Failed to send message: {response.text}")
+                return None
+            return item
+
+        accepted = [item for item in await gather(*(send_one(item) for item in pending)) if item is not None]
+
+    conversations = await get_or_create_conversations(
+        session, latest_activity((key, messages[index].timestamp) for index, key, _, _ in accepted)
     )
-    
-    session.add(message)
-    session.commit()
-    session.refresh(message)
-    return {**incoming.dict()}
 
+    status = DeliveryStatus.queued if deferred else DeliveryStatus.sent
+    rows = [
+        {**messages[index].model_dump(), "conversation_id": conversations[key], "status": status}
+        for index, key, _, _ in accepted
+    ]
+    message_ids = await insert_messages(session, rows)
+    await update_summaries(session, [{**row, "id": message_id} for row, message_id in zip(rows, message_ids)])
+
+    if deferred and message_ids:
+        now = datetime.now(timezone.utc)
+        await session.exec(insert(Outbox), params=[
+            {
+                "message_id": message_id,
+                "provider": provider,
+                "payload": OUTGOING.dump_python(outgoing, mode="json", by_alias=True, exclude_none=True),
+                "next_attempt_at": now,
+                "created_at": now,
+            }
+            for (_, _, provider, outgoing), message_id in zip(accepted, message_ids)
+        ])
+    await session.commit()
+
+    for (index, key, _, _), message_id in zip(accepted, message_ids):
+        results[index] = {"index": index, "status": status, "id": message_id, "conversation_id": conversations[key]}
+
+    if deferred:
+        notify_workers()
+        http_response.status_code = 202
+    return results
+
+def is_text(incoming: IncomingMessage):
+    return incoming.type in [TextMessageType.sms, TextMessageType.mms]
+
+def received_result(index: int, message_id: int, conversation_id: int):
+    return {"index": index, "status": DeliveryStatus.received, "id": message_id, "conversation_id": conversation_id}
+
+async def store_incoming(session: AsyncSession, items: list[tuple[int, IncomingMessage]], results: dict):
+    # Redeliveries, of earlier messages or within this batch, are answered with
+    # the result of the first delivery and never written again
+    provider_ids = {incoming.messageProviderID for _, incoming in items}
+    await lock_provider_ids(session, provider_ids)
+    stored = await find_received(session, provider_ids)
+    first = {}
+    repeated = []
+    for index, incoming in items:
+        if incoming.messageProviderID in stored or incoming.messageProviderID in first:
+            repeated.append((index, incoming.messageProviderID))
+        else:
+            first[incoming.messageProviderID] = (index, incoming)
+    items = list(first.values())
+
+    texts = [incoming for _, incoming in items if is_text(incoming)]
+    emails = [incoming for _, incoming in items if not is_text(incoming)]
+    users_by_phone = await get_user_ids_by_address(session, User.phone_key, {m.destination for m in texts})
+    users_by_email = await get_user_ids_by_address(session, User.email_key, {m.destination for m in emails})
+    # Contacts are looked up within the user each message is addressed to
+    contacts_by_phone = await get_contact_ids_by_address(session, Contact.phone_key, {
+        (users_by_phone[m.destination], m.source) for m in texts if m.destination in users_by_phone
+    })
+    contacts_by_email = await get_contact_ids_by_address(session, Contact.email_key, {
+        (users_by_email[m.destination], m.source) for m in emails if m.destination in users_by_email
+    })
+
+    accepted = []
+    for index, incoming in items:
+        if is_text(incoming):
+            user_id = users_by_phone.get(incoming.destination)
+            contact_id = contacts_by_phone.get((user_id, incoming.source))
+            conversation_type = ConversationType.text
+            message_type = incoming.type
+        else:
+            user_id = users_by_email.get(incoming.destination)
+            contact_id = contacts_by_email.get((user_id, incoming.source))
+            conversation_type = ConversationType.email
+            message_type = ConversationType.email
+
+        if user_id is None:
+            results[index] = batch_error(index, 404, f"No user associated with destination {incoming.destination}")
+            continue
+        if contact_id is None:
+            results[index] = batch_error(index, 404, f"No contact associated with source {incoming.source}")
+            continue
+
+        accepted.append((index, (user_id, contact_id, conversation_type), {
+            "user_id": user_id,
+            "contact_id": contact_id,
+            "message_type": message_type,
+            "content": incoming.body,
+            "attachment": incoming.attachment or [],
+            "timestamp": incoming.timestamp,
+            "status": DeliveryStatus.received,
+            "provider_message_id": incoming.messageProviderID,
+        }))
+
+    conversations = await get_or_create_conversations(
+        session, latest_activity((key, row["timestamp"]) for _, key, row in accepted)
+    )
+    inserted = await insert_received(session, [
+        {**row, "conversation_id": conversations[key]} for _, key, row in accepted
+    ])
+    new_messages = [
+        {**row, "conversation_id": conversations[key], "id": inserted[row["provider_message_id"]][0]}
+        for _, key, row in accepted if row["provider_message_id"] in inserted
+    ]
+    await update_summaries(session, new_messages)
+    await stream.publish(session, new_messages)
+    await session.commit()
+    remember_received(inserted)
+
+    # Anything not inserted was stored concurrently by another request
+    raced = {row["provider_message_id"] for _, _, row in accepted} - inserted.keys()
+    if raced:
+        stored.update(await find_received(session, raced))
+
+    for index, _, row in accepted:
+        provider_id = row["provider_message_id"]
+        results[index] = received_result(index, *inserted.get(provider_id) or stored[provider_id])
+    for index, provider_id in repeated:
+        if provider_id in stored:
+            results[index] = received_result(index, *stored[provider_id])
+        else:
+            results[index] = {**results[first[provider_id][0]], "index": index}
+
+def validation_error(index: int, error: ValidationError):
+    return batch_error(index, 422, error.errors(include_url=False, include_context=False, include_input=False))
+
+@router.post("/receive/batch", response_model=List[BatchResult], response_model_exclude_none=True)
+async def receive_batch(payload: List[Any], session: AsyncSession = Depends(get_session)):
+    if len(payload) > config.MESSAGES_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {config.MESSAGES_BATCH_MAX_SIZE} messages")
+
+    results = {}
+    items = []
+    for index, item in enumerate(payload):
+        try:
+            items.append((index, IncomingMessage.model_validate(item)))
+        except ValidationError as e:
+            results[index] = validation_error(index, e)
+
+    await store_incoming(session, items, results)
+    return [results[index] for index in range(len(payload))]
+
+@router.post("/receive/stream")
+async def receive_stream(request: Request, session: AsyncSession = Depends(get_session)):
+    # Newline delimited JSON, one IncomingMessage per line, stored in chunks of
+    # MESSAGES_RECEIVE_CHUNK_SIZE. Only failures are reported back item by item.
+    results = {}
+    chunk = []
+    index = 0
+    received = 0
+
+    async def flush():
+        nonlocal received
+        chunk_results = {}
+        await store_incoming(session, chunk, chunk_results)
+        for result in chunk_results.values():
+            if result["status"] == "error":
+                results[result["index"]] = result
+            else:
+                received += 1
+        chunk.clear()
+
+    async def parse(line: bytes):
+        nonlocal index
+        if not line.strip():
+            return
+        try:
+            chunk.append((index, IncomingMessage.model_validate_json(line)))
+        except ValidationError as e:
+            results[index] = validation_error(index, e)
+        index += 1
+        if len(chunk) >= config.MESSAGES_RECEIVE_CHUNK_SIZE:
+            await flush()
+
+    buffer = b""
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            await parse(line)
+    await parse(buffer)
+    if chunk:
+        await flush()
+
+    return {"received": received, "failed": len(results), "errors": sorted(results.values(), key=lambda r: r["index"])}
@@ -0,0 +1,20 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import metrics
+import providers
+from database import pool_stats
+
+router = APIRouter(
+    tags=["metrics"]
+)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def read_metrics():
+    # Point-in-time gauges are sampled on scrape rather than kept up to date
+    pool = pool_stats()
+    metrics.db_pool_checked_out.set(pool["checked_out"])
+    metrics.db_pool_overflow.set(pool["overflow"])
+    providers.update_metrics()
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
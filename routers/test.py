@@ -1,4 +1,12 @@
-from fastapi import APIRouter, HTTPException
+import random
+from asyncio import sleep
+from collections import Counter
+
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, Field
+
+import config
 
 
 router = APIRouter(
@@ -6,12 +14,58 @@ router = APIRouter(
     tags=["test"]
 )
 
-request_count = 0
+
+class FakeProvider(BaseModel):
+    latency: float = Field(config.FAKE_PROVIDER_LATENCY, ge=0, description="Seconds added to every response")
+    jitter: float = Field(config.FAKE_PROVIDER_JITTER, ge=0, description="Uniform +/- seconds around latency")
+    error_rate: float = Field(config.FAKE_PROVIDER_ERROR_RATE, ge=0, le=1, description="Share of requests answered with 500")
+    throttle_rate: float = Field(config.FAKE_PROVIDER_THROTTLE_RATE, ge=0, le=1, description="Share of requests answered with 429")
+    max_concurrency: int = Field(config.FAKE_PROVIDER_MAX_CONCURRENCY, ge=0, description="429 above this many concurrent requests, 0 for no limit")
+    retry_after: float | None = Field(config.FAKE_PROVIDER_RETRY_AFTER, ge=0, description="Retry-After sent with 429s")
+
+
+provider = FakeProvider()
+responses = Counter()
+in_flight = 0
+
+
+def throttled():
+    headers = {"Retry-After": f"{provider.retry_after:g}"} if provider.retry_after is not None else None
+    return JSONResponse({"detail": "Too many requests, please try again later."}, status_code=429, headers=headers)
+
+
+@router.get("/provider")
+async def read_fake_provider():
+    return {"settings": provider, "responses": responses, "in_flight": in_flight}
+
+
+@router.put("/provider")
+async def update_fake_provider(settings: FakeProvider):
+    # Replaces the fake provider's behaviour and resets its counters
+    global provider
+    provider = settings
+    responses.clear()
+    return provider
+
 
 @router.post("/messages/receive")
 async def test_receive_message(json: dict):
-    # global request_count
-    # request_count += 1
-    # if request_count < 4:
-    #     raise HTTPException(status_code=429, detail=f"Too many requests, please try again later. {request_count}")
-    return {"status": "success", "message": "Message received successfully", "data": json}
\ No newline at end of file
+    global in_flight
+    in_flight += 1
+    try:
+        if provider.max_concurrency and in_flight > provider.max_concurrency:
+            responses[429] += 1
+            return throttled()
+        if provider.latency or provider.jitter:
+            await sleep(max(0.0, provider.latency + random.uniform(-provider.jitter, provider.jitter)))
+        roll = random.random()
+        if roll < provider.throttle_rate:
+            responses[429] += 1
+            return throttled()
+        if roll < provider.throttle_rate + provider.error_rate:
+            responses[500] += 1
+            return JSONResponse({"detail": "Provider error"}, status_code=500)
+        responses[200] += 1
+        return {"status": "success", "message": "Message received successfully", "data": json}
+    finally:
+        in_flight -= 1
\ No newline at end of file
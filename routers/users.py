@@ -1,25 +1,137 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import List
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import tuple_
 from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from models.sql.user import User, UserBase
+from models.sql.conversations import Conversation
+from models.sql.messages import Message
+from models.enums import DeliveryStatus
+from models.conversations import ConversationRead
+from models.users import UserRead
+from models.pagination import Page
 from database import get_session
+from pagination import page_limit, decode_cursor, next_cursor
+from export import ndjson_response
+from cache import invalidate_addresses
+from addresses import address_keys
+import config
+import stream
 
 router = APIRouter(
     prefix="/users",
     tags=["users"]
 )
 
-@router.put("/")
-async def create_user(user: UserBase, session: Session = Depends(get_session)):
-    db_user = User.model_validate(user)
+@router.put("/", response_model=UserRead)
+async def create_user(user: UserBase, session: AsyncSession = Depends(get_session)):
+    db_user = User.model_validate(user, update=address_keys(user))
     session.add(db_user)
-    session.commit()
-    session.refresh(db_user)
+    await session.commit()
+    await session.refresh(db_user)
+    invalidate_addresses("users", db_user)
     return db_user
 
-@router.get("/")
-async def read_user(session: Session = Depends(get_session)):
-    user = session.exec(select(User)).all()
-    if not user:
+@router.get("/", response_model=List[UserRead])
+async def read_user(
+    response: Response,
+    cursor: str | None = None,
+    limit: int = Depends(page_limit),
+    session: AsyncSession = Depends(get_session)
+):
+    # Keyset paginated on id; the cursor for the next page is returned in the
+    # X-Next-Cursor header so the body stays a plain list
+    statement = select(User)
+    if cursor is not None:
+        (after_id,) = decode_cursor(cursor, int)
+        statement = statement.where(User.id > after_id)
+    user = list((await session.exec(statement.order_by(User.id).limit(limit + 1))).all())
+    if not user and cursor is None:
         raise HTTPException(status_code=404, detail="No users found")
-    return user
\ No newline at end of file
+    if (next_page := next_cursor(user, limit, lambda row: (row.id,))) is not None:
+        response.headers["X-Next-Cursor"] = next_page
+    return user
+
+@router.get("/export")
+async def export_users():
+    return ndjson_response(
+        select(User.id, User.name, User.phone_number, User.email_address).order_by(User.id)
+    )
+
+@router.get("/{user_id}/conversations", response_model=Page[ConversationRead])
+async def read_user_conversations(
+    user_id: int,
+    cursor: str | None = None,
+    limit: int = Depends(page_limit),
+    session: AsyncSession = Depends(get_session)
+):
+    # Most recently active first, keyset paginated on (last_message_at, id).
+    # Conversations without a last_message_at (nothing summarized yet) come
+    # last, ordered by id alone.
+    statement = select(
+        Conversation.id,
+        Conversation.contact_id,
+        Conversation.type,
+        Conversation.started_at,
+        Conversation.last_message_at,
+        Conversation.last_message_id,
+        Conversation.last_message_preview,
+        Conversation.message_count,
+        Conversation.unread_count
+    ).where(Conversation.user_id == user_id)
+    if cursor is not None:
+        last_message_at, conversation_id = decode_cursor(cursor, datetime | None, int)
+        if last_message_at is None:
+            statement = statement.where(Conversation.last_message_at.is_(None) & (Conversation.id < conversation_id))
+        else:
+            statement = statement.where(
+                (tuple_(Conversation.last_message_at, Conversation.id) < (last_message_at, conversation_id)) |
+                Conversation.last_message_at.is_(None)
+            )
+    rows = (await session.exec(
+        statement.order_by(Conversation.last_message_at.desc().nulls_last(), Conversation.id.desc()).limit(limit + 1)
+    )).all()
+
+    if not rows and cursor is None and await session.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    cursor = next_cursor(rows, limit, lambda row: (row.last_message_at, row.id))
+    return Page(items=[row._asdict() for row in rows], next_cursor=cursor)
+
+@router.get("/{user_id}/stream")
+async def stream_user_messages(
+    user_id: int,
+    last_event_id: int | None = Header(default=None),
+    session: AsyncSession = Depends(get_session)
+):
+    # Server-sent events for messages received by the user. Reconnecting
+    # clients send Last-Event-ID and first get what they missed.
+    if await session.get(User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+
+    # Subscribe before reading the backlog so nothing falls in between
+    subscriber = stream.subscribe(user_id)
+    replay = []
+    if last_event_id is not None:
+        try:
+            rows = (await session.exec(
+                select(*(getattr(Message, field) for field in stream.FIELDS)).where(
+                    (Message.user_id == user_id) &
+                    (Message.status == DeliveryStatus.received) &
+                    (Message.id > last_event_id)
+                ).order_by(Message.id).limit(config.STREAM_REPLAY_LIMIT)
+            )).all()
+        except BaseException:
+            stream.unsubscribe(subscriber)
+            raise
+        replay = [stream.message_event(row._asdict()) for row in rows]
+    # Don't hold a pooled connection for the lifetime of the stream
+    await session.close()
+
+    return StreamingResponse(
+        stream.event_stream(subscriber, replay),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
\ No newline at end of file
@@ -0,0 +1,190 @@
+import asyncio
+import json
+import logging
+
+import asyncpg
+from sqlalchemy import text
+from sqlmodel import select
+
+import config
+import database
+from models.messages import MessageRead
+from models.sql.messages import Message
+
+logger = logging.getLogger(__name__)
+
+# NOTIFY is transactional, so subscribers only ever hear about committed rows
+NOTIFY = text("SELECT pg_notify(:channel, payload) FROM unnest(CAST(:payloads AS text[])) AS payload")
+# NOTIFY payloads are limited to 8000 bytes; bigger messages are announced by
+# id and loaded by the listening process
+MAX_PAYLOAD = 7900
+
+FIELDS = list(MessageRead.model_fields)
+
+
+class Subscriber:
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue = asyncio.Queue(maxsize=config.STREAM_QUEUE_SIZE)
+        self.closed = False
+
+    def offer(self, message: dict):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # A consumer that cannot keep up is dropped instead of buffered
+            # for; it resumes from Last-Event-ID when it reconnects
+            self.close()
+
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+
+subscribers: dict[int, set[Subscriber]] = {}
+listener: asyncio.Task | None = None
+# Pending loads of messages announced by reference; the loop only keeps weak
+# references to tasks
+deliveries: set[asyncio.Task] = set()
+
+
+def subscribe(user_id: int) -> Subscriber:
+    subscriber = Subscriber(user_id)
+    subscribers.setdefault(user_id, set()).add(subscriber)
+    return subscriber
+
+
+def unsubscribe(subscriber: Subscriber):
+    targets = subscribers.get(subscriber.user_id)
+    if targets is not None:
+        targets.discard(subscriber)
+        if not targets:
+            del subscribers[subscriber.user_id]
+
+
+def message_event(message: dict) -> dict:
+    return MessageRead.model_validate({field: message.get(field) for field in FIELDS}).model_dump(mode="json")
+
+
+async def publish(session, messages: list[dict]):
+    # Call before commit, in the transaction that stores the messages
+    if not config.STREAM_NOTIFY or not messages:
+        return
+    payloads = []
+    for message in messages:
+        payload = json.dumps(message_event(message))
+        if len(payload.encode()) > MAX_PAYLOAD:
+            payload = json.dumps({"id": message["id"], "user_id": message["user_id"], "ref": True})
+        payloads.append(payload)
+    await session.exec(NOTIFY, params={"channel": config.STREAM_CHANNEL, "payloads": payloads})
+
+
+async def load_message(message_id: int):
+    async with database.session_factory() as session:
+        row = (await session.exec(
+            select(*(getattr(Message, field) for field in FIELDS)).where(Message.id == message_id)
+        )).first()
+    return message_event(row._asdict()) if row is not None else None
+
+
+async def deliver_reference(user_id: int, message_id: int):
+    try:
+        message = await load_message(message_id)
+    except Exception:
+        logger.exception("Loading streamed message %s failed", message_id)
+        return
+    if message is not None:
+        for subscriber in list(subscribers.get(user_id, ())):
+            subscriber.offer(message)
+
+
+def on_notification(connection, pid, channel, payload: str):
+    message = json.loads(payload)
+    targets = subscribers.get(message["user_id"])
+    if not targets:
+        return
+    if message.get("ref"):
+        task = asyncio.get_running_loop().create_task(deliver_reference(message["user_id"], message["id"]))
+        deliveries.add(task)
+        task.add_done_callback(deliveries.discard)
+        return
+    for subscriber in list(targets):
+        subscriber.offer(message)
+
+
+def listener_dsn() -> str:
+    url = database.init_engine().url.set(drivername="postgresql")
+    return url.render_as_string(hide_password=False)
+
+
+async def listen():
+    while True:
+        connection = None
+        try:
+            connection = await asyncpg.connect(listener_dsn())
+            lost = asyncio.Event()
+            connection.add_termination_listener(lambda _: lost.set())
+            await connection.add_listener(config.STREAM_CHANNEL, on_notification)
+            await lost.wait()
+            logger.warning("Stream listener connection lost, reconnecting")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Stream listener failed, reconnecting")
+        finally:
+            if connection is not None and not connection.is_closed():
+                await connection.close()
+            # Notifications sent while there was no listener are gone; current
+            # subscribers reconnect and replay from Last-Event-ID
+            for targets in list(subscribers.values()):
+                for subscriber in list(targets):
+                    subscriber.close()
+        await asyncio.sleep(config.STREAM_RECONNECT_DELAY)
+
+
+async def start_listener():
+    global listener
+    if listener is None:
+        listener = asyncio.create_task(listen())
+
+
+async def stop_listener():
+    global listener
+    if listener is not None:
+        listener.cancel()
+        await asyncio.gather(listener, return_exceptions=True)
+        listener = None
+    for task in deliveries:
+        task.cancel()
+    await asyncio.gather(*deliveries, return_exceptions=True)
+
+
+def format_event(message: dict) -> str:
+    return f"id: {message['id']}\nevent: message\ndata: {json.dumps(message)}\n\n"
+
+
+async def event_stream(subscriber: Subscriber, replay: list[dict]):
+    # Server-sent events: missed messages first, then live ones, with a comment
+    # line as heartbeat so idle connections stay open through proxies
+    try:
+        last_id = 0
+        for message in replay:
+            last_id = message["id"]
+            yield format_event(message)
+        while not subscriber.closed:
+            try:
+                message = await asyncio.wait_for(subscriber.queue.get(), timeout=config.STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if message is None:
+                break
+            # Already sent as part of the replay
+            if message["id"] <= last_id:
+                continue
+            yield format_event(message)
+    finally:
+        unsubscribe(subscriber)
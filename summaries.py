@@ -0,0 +1,124 @@
+from sqlalchemy import func, text
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import config
+import database
+from models.enums import DeliveryStatus
+from models.sql.conversations import Conversation
+
+# Adds a batch of new messages to their conversations' summaries. Runs after
+# upsert_conversations in the same transaction, which has already moved
+# last_message_at forward, so a batch whose latest message is at least that
+# recent also becomes the conversation's last message.
+UPDATE = text("""
+    UPDATE conversations AS c SET
+        message_count = c.message_count + s.messages,
+        unread_count = c.unread_count + s.unread,
+        last_message_id = CASE
+            WHEN c.last_message_id IS NULL OR s.last_at >= c.last_message_at THEN s.last_id
+            ELSE c.last_message_id END,
+        last_message_preview = CASE
+            WHEN c.last_message_id IS NULL OR s.last_at >= c.last_message_at THEN s.preview
+            ELSE c.last_message_preview END
+    FROM unnest(
+        CAST(:conversation_ids AS integer[]),
+        CAST(:messages AS integer[]),
+        CAST(:unread AS integer[]),
+        CAST(:last_ids AS integer[]),
+        CAST(:last_ats AS timestamptz[]),
+        CAST(:previews AS text[])
+    ) AS s(conversation_id, messages, unread, last_id, last_at, preview)
+    WHERE c.id = s.conversation_id
+""")
+
+# Recomputes the summaries of a range of conversations from scratch. Received
+# messages with an id above last_read_message_id (stored after the
+# conversation was last marked read) count as unread.
+REBUILD = text("""
+    UPDATE conversations AS c SET
+        message_count = counts.messages,
+        unread_count = counts.unread,
+        last_message_id = latest.id,
+        last_message_preview = latest.preview,
+        last_message_at = coalesce(latest.timestamp, c.last_message_at)
+    FROM conversations AS target
+    CROSS JOIN LATERAL (
+        SELECT
+            count(*) AS messages,
+            count(*) FILTER (
+                WHERE m.status = 'received' AND m.id > coalesce(target.last_read_message_id, 0)
+            ) AS unread
+        FROM messages AS m
+        WHERE m.conversation_id = target.id
+    ) AS counts
+    LEFT JOIN LATERAL (
+        SELECT m.id, m.timestamp, left(m.content, :preview_length) AS preview
+        FROM messages AS m
+        WHERE m.conversation_id = target.id
+        ORDER BY m.timestamp DESC, m.id DESC
+        LIMIT 1
+    ) AS latest ON true
+    WHERE c.id = target.id AND target.id BETWEEN :first AND :last
+""")
+
+
+async def update_summaries(session: AsyncSession, messages: list[dict]):
+    # messages need id, conversation_id, timestamp, content and status
+    summaries = {}
+    for message in messages:
+        summary = summaries.setdefault(message["conversation_id"], {"messages": 0, "unread": 0, "last": None})
+        summary["messages"] += 1
+        summary["unread"] += message["status"] == DeliveryStatus.received
+        last = summary["last"]
+        if last is None or (message["timestamp"], message["id"]) > (last["timestamp"], last["id"]):
+            summary["last"] = message
+    if not summaries:
+        return
+
+    # Same order as upsert_conversations took the row locks in
+    conversation_ids = sorted(summaries)
+    ordered = [summaries[conversation_id] for conversation_id in conversation_ids]
+    await session.exec(UPDATE, params={
+        "conversation_ids": conversation_ids,
+        "messages": [summary["messages"] for summary in ordered],
+        "unread": [summary["unread"] for summary in ordered],
+        "last_ids": [summary["last"]["id"] for summary in ordered],
+        "last_ats": [summary["last"]["timestamp"] for summary in ordered],
+        "previews": [summary["last"]["content"][:config.CONVERSATION_PREVIEW_LENGTH] for summary in ordered],
+    })
+
+
+async def rebuild(batch_size: int = config.SUMMARY_REBUILD_BATCH_SIZE):
+    # Backfill for existing data, or repair after messages were changed out of
+    # band. Each range of conversation ids is its own transaction.
+    async with database.session_factory() as session:
+        first, last = (await session.exec(select(func.min(Conversation.id), func.max(Conversation.id)))).one()
+        await session.commit()
+        if first is None:
+            return 0
+        rebuilt = 0
+        for start in range(first, last + 1, batch_size):
+            result = await session.exec(REBUILD, params={
+                "first": start,
+                "last": start + batch_size - 1,
+                "preview_length": config.CONVERSATION_PREVIEW_LENGTH,
+            })
+            await session.commit()
+            rebuilt += result.rowcount
+        return rebuilt
+
+
+if __name__ == "__main__":
+    import argparse
+    import asyncio
+
+    parser = argparse.ArgumentParser(description="Rebuild conversation summaries from the messages table")
+    parser.add_argument("--batch-size", type=int, default=config.SUMMARY_REBUILD_BATCH_SIZE)
+
+    async def main(args):
+        database.init_engine()
+        print(f"Rebuilt {await rebuild(args.batch_size)} conversations")
+        await database.dispose_engine()
+
+    asyncio.run(main(parser.parse_args()))
@@ -1,7 +1,15 @@
+import asyncio
+import atexit
 import httpx
-import json
+import os
+import subprocess
+import sys
+import time
 
-import psycopg2
+from sqlalchemy import text
+
+import database
+import partitions
 
 drop_tables = """
 DO $$ DECLARE
@@ -15,38 +23,54 @@ BEGIN
     END LOOP;
 END $$;
 """
-# Connect to the database
-conn_params = {
-    'host': 'localhost',
-    'database': 'hatch',
-    'user': 'user',
-    'password': 'password'
-}
+root = os.path.dirname(os.path.abspath(__file__))
 
+# The server caches ids by address and stored provider message ids, which
+# would point at rows dropped below, so it is started here once the database
+# has been rebuilt rather than reused
 try:
-    # Establish a connection
-    conn = psycopg2.connect(**conn_params)
+    httpx.get("http://127.0.0.1:8000/health/cache")
+    sys.exit("A server is already listening on port 8000, stop it first: test.py starts its own")
+except httpx.ConnectError:
+    pass
+
+
+async def reset_database():
+    # Same DATABASE_URL as the server
+    async with database.init_engine().begin() as conn:
+        await conn.execute(text(drop_tables))
+    await database.create_schema()
+    async with database.session_factory() as session:
+        await partitions.ensure_partitions(session)
+    await database.dispose_engine()
 
-    # Create a cursor object
-    cur = conn.cursor()
+asyncio.run(reset_database())
+print("Database recreated successfully.")
 
-    # Execute a query
-    cur.execute(drop_tables)
-    
-    # Close the cursor and connection
-    cur.close()
-    conn.commit()
-    print("All tables dropped successfully.")
-    conn.close()
+server = subprocess.Popen(
+    [sys.executable, "-m", "uvicorn", "api:app", "--port", "8000", "--log-level", "warning"],
+    cwd=root
+)
+atexit.register(lambda: (server.terminate(), server.wait()))
 
-except psycopg2.Error as e:
-    print(f"Error connecting to or querying the database: {e}")
+for _ in range(100):
+    try:
+        httpx.get("http://127.0.0.1:8000/health/cache")
+        break
+    except httpx.ConnectError:
+        assert server.poll() is None, "Server failed to start"
+        time.sleep(0.1)
 
 
 user_url = "http://127.0.0.1:8000/users/"
 contacts_url = "http://127.0.0.1:8000/contacts/"
 recive_url = 'http://127.0.0.1:8000/messages/receive'
 send_url = 'http://127.0.0.1:8000/messages/send'
+attachments_url = 'http://127.0.0.1:8000/attachments/'
+send_batch_url = 'http://127.0.0.1:8000/messages/send/batch'
+receive_batch_url = 'http://127.0.0.1:8000/messages/receive/batch'
+search_url = 'http://127.0.0.1:8000/messages/search'
+import_url = 'http://127.0.0.1:8000/contacts/import'
 
 users = []
 contacts = []
@@ -109,20 +133,25 @@ r = httpx.post(send_url, json={
 
 assert r.status_code != 200, "Conversation should not exist and should fail"
 
+r = httpx.post(attachments_url, content=b"snowman.png", headers={"content-type": "image/png"})
+
+assert r.status_code == 201, "Failed to upload attachment"
+attachment_id = r.json()["id"]
+
 r = httpx.post(send_url, json={
     "user_id": 2,
     "contact_id": 2,
     "message_type": "sms",
     "content": "Do you want to build a snowman?",
     "attachment": [
-        "string"
+        attachment_id
     ],
     "timestamp": "2025-06-13T15:31:51Z"
 })
 
 assert r.status_code == 200, "Failed to send message"
 
-r = httpx.post(recive_url, data=json.dumps({
+received_message = {
     "from": "+18045551234",
     "to": "+12016661234",
     "type": "sms",
@@ -130,6 +159,172 @@ r = httpx.post(recive_url, data=json.dumps({
     "body": "text message",
     "attachment": None,
     "timestamp": "2024-11-01T14:00:00Z"
-}))
+}
+r = httpx.post(recive_url, json=received_message)
 
 assert r.status_code == 200, "Failed to receive message"
+received = r.json()
+
+# A redelivery is answered with the stored message
+r = httpx.post(recive_url, json=received_message)
+
+assert r.status_code == 200, "Failed to receive redelivered message"
+assert r.json()["id"] == received["id"], "Redelivered message was stored twice"
+
+# The provider id alone identifies a message, whatever timestamp a redelivery
+# carries
+r = httpx.post(recive_url, json={**received_message, "timestamp": "2024-11-01T14:05:00Z"})
+
+assert r.status_code == 200, "Failed to receive redelivered message"
+assert r.json()["id"] == received["id"], "Redelivery with another timestamp was stored twice"
+
+r = httpx.post(receive_batch_url, json=[{**received_message, "timestamp": "2024-12-01T14:00:00Z"}])
+
+assert r.status_code == 200, "Failed to receive redelivered batch"
+assert r.json()[0]["id"] == received["id"], "Batch redelivery with another timestamp was stored twice"
+
+# Differently formatted addresses resolve to the same user and contact
+r = httpx.post(recive_url, json={
+    **received_message,
+    "messaging_provider_id": "message-2",
+    "from": "tel:+1-804-555-1234",
+    "to": "+1 (201) 666-1234"
+})
+
+assert r.status_code == 200, "Failed to receive message from reformatted addresses"
+assert r.json()["conversation_id"] == received["conversation_id"], "Reformatted addresses resolved elsewhere"
+
+# Batches answer per item
+r = httpx.post(send_batch_url, json=[
+    {
+        "user_id": 2,
+        "contact_id": 2,
+        "message_type": "email",
+        "content": "The snowman has a carrot nose",
+        "timestamp": "2025-06-13T15:35:00Z"
+    },
+    {
+        "user_id": 2,
+        "contact_id": 999,
+        "message_type": "sms",
+        "content": "Nobody is listening",
+        "timestamp": "2025-06-13T15:36:00Z"
+    }
+])
+
+assert r.status_code == 200, "Failed to send batch"
+assert [item["status"] for item in r.json()] == ["sent", "error"], "Unexpected batch send results"
+assert r.json()[1]["status_code"] == 404, "Unknown contact should fail its item only"
+
+r = httpx.post(receive_batch_url, json=[
+    {
+        "from": "+18045551235",
+        "to": "+12016661235",
+        "type": "sms",
+        "messaging_provider_id": f"batch-{index}",
+        "body": f"Snowman number {index}",
+        "attachment": None,
+        "timestamp": f"2025-06-13T16:0{index}:00Z"
+    }
+    for index in range(3)
+])
+
+assert r.status_code == 200, "Failed to receive batch"
+assert all(item["status"] == "received" for item in r.json()), "Unexpected batch receive results"
+conversation_id = r.json()[0]["conversation_id"]
+
+# Idempotency-Key: the same request is replayed, a different one is refused
+message = {
+    "user_id": 1,
+    "contact_id": 1,
+    "message_type": "sms",
+    "content": "Sent exactly once",
+    "timestamp": "2025-06-13T15:40:00Z"
+}
+r = httpx.post(send_url, json=message, headers={"Idempotency-Key": "test-key-1"})
+
+assert r.status_code == 200, "Failed to send message with Idempotency-Key"
+first = r.json()
+
+r = httpx.post(send_url, json=message, headers={"Idempotency-Key": "test-key-1"})
+
+assert r.status_code == 200 and r.json() == first, "Idempotent send was not replayed"
+assert r.headers.get("Idempotent-Replayed") == "true", "Replay is not marked"
+
+r = httpx.post(send_url, json={**message, "content": "Something else"}, headers={"Idempotency-Key": "test-key-1"})
+
+assert r.status_code == 422, "Reusing an Idempotency-Key for another request should fail"
+
+# Search pages through all matches in rank order
+found = []
+cursor = None
+while True:
+    params = {"user_id": 2, "q": "snowman", "limit": 2}
+    if cursor is not None:
+        params["cursor"] = cursor
+    r = httpx.get(search_url, params=params)
+    assert r.status_code == 200, "Failed to search messages"
+    found.extend(item["id"] for item in r.json()["items"])
+    cursor = r.json()["next_cursor"]
+    if cursor is None:
+        break
+
+assert len(found) == 5 and len(set(found)) == 5, "Search did not return every match exactly once"
+
+r = httpx.get("http://127.0.0.1:8000/users/2/conversations")
+
+assert r.status_code == 200, "Failed to read inbox"
+assert conversation_id in [item["id"] for item in r.json()["items"]], "Conversation missing from inbox"
+
+r = httpx.get(f"http://127.0.0.1:8000/conversations/{conversation_id}/messages")
+
+assert r.status_code == 200, "Failed to read conversation history"
+assert len(r.json()["items"]) >= 3, "Conversation history is incomplete"
+
+# Contact import: quoted fields may span lines, known addresses are skipped
+r = httpx.post(import_url, headers={"content-type": "text/csv"}, content=(
+    'user_id,name,phone_number,email_address\n'
+    '1,"Olaf\nthe snowman",+18045551236,olaf@example.com\n'
+    '1,John again,+1 804 555 1234,john.smith@example.com\n'
+))
+
+assert r.status_code == 200, "Failed to import contacts"
+assert (r.json()["inserted"], r.json()["skipped"]) == (1, 1), "Unexpected import result"
+
+# An address known to several users resolves to the contact of the user the
+# message is addressed to
+r = httpx.put(contacts_url, json={
+    "user_id": 2,
+    "name": "John Smith",
+    "phone_number": "+18045551234",
+    "email_address": "john.smith@example.com"
+})
+assert r.status_code == 200, "Failed to create contact"
+shared_contact = r.json()
+
+r = httpx.post(recive_url, json={**received_message, "to": "+12016661235", "messaging_provider_id": "shared-1"})
+
+assert r.status_code == 200, "Failed to receive message for shared contact"
+single = r.json()
+
+r = httpx.post(receive_batch_url, json=[
+    {**received_message, "to": "+12016661235", "messaging_provider_id": "shared-2"}
+])
+
+assert r.status_code == 200, "Failed to receive batch for shared contact"
+assert r.json()[0]["conversation_id"] == single["conversation_id"], "Batch and single receive disagree"
+
+r = httpx.get(f"http://127.0.0.1:8000/conversations/{single['conversation_id']}/messages")
+
+assert r.status_code == 200, "Failed to read conversation history"
+assert {item["contact_id"] for item in r.json()["items"]} == {shared_contact["id"]}, "Shared address resolved to another user's contact"
+
+# Partition maintenance runs against the same DATABASE_URL as the server
+result = subprocess.run(
+    [sys.executable, "partitions.py", "ensure"],
+    cwd=root,
+    capture_output=True,
+    text=True
+)
+
+assert result.returncode == 0, f"Partition maintenance failed: {result.stderr}"
@@ -0,0 +1,44 @@
+from types import SimpleNamespace
+
+import pytest
+from pydantic import TypeAdapter, ValidationError
+
+from addresses import Address, address_key, address_keys, email_key, phone_key
+
+
+@pytest.mark.parametrize("value", ["+12016661234", "tel:+1-201-666-1234", "+1 (201) 666-1234", "+1.201.666.1234"])
+def test_phone_formats_share_a_key(value):
+    assert phone_key(value) == "+12016661234"
+
+
+@pytest.mark.parametrize("value", ["Jane@Example.com", "jane@example.com", "JANE@EXAMPLE.COM"])
+def test_email_key_is_lowercased(value):
+    assert email_key(value) == "jane@example.com"
+
+
+@pytest.mark.parametrize("value", ["12345", "+1 555", "not a number"])
+def test_invalid_phone(value):
+    with pytest.raises(ValueError):
+        phone_key(value)
+
+
+def test_invalid_email():
+    with pytest.raises(ValueError):
+        email_key("jane@")
+
+
+def test_address_key_picks_the_kind():
+    assert address_key("Jane@Example.com") == "jane@example.com"
+    assert address_key("tel:+1-201-666-1234") == "+12016661234"
+
+
+def test_address_keys_skip_missing_addresses():
+    row = SimpleNamespace(phone_number="tel:+1-804-555-1234", email_address=None)
+    assert address_keys(row) == {"phone_key": "+18045551234", "email_key": None}
+
+
+def test_address_type_validates_to_its_key():
+    adapter = TypeAdapter(Address)
+    assert adapter.validate_python("+1 (201) 666-1234") == "+12016661234"
+    with pytest.raises(ValidationError):
+        adapter.validate_python("nobody")
@@ -0,0 +1,85 @@
+import asyncio
+
+import cache
+from cache import MISSING, TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(cache, "monotonic", clock)
+    return TTLCache(**kwargs), clock
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    ttl_cache, clock = make_cache(monkeypatch, maxsize=10, ttl=5)
+    ttl_cache.set("a", 1)
+    clock.now += 4.9
+    assert ttl_cache.get("a") == 1
+    clock.now += 0.1
+    assert ttl_cache.get("a") is MISSING
+    assert ttl_cache.stats()["expirations"] == 1
+    assert "a" not in ttl_cache.entries
+
+
+def test_none_uses_negative_ttl(monkeypatch):
+    ttl_cache, clock = make_cache(monkeypatch, maxsize=10, ttl=60, negative_ttl=1)
+    ttl_cache.set("missing", None)
+    assert ttl_cache.get("missing") is None
+    clock.now += 1
+    assert ttl_cache.get("missing") is MISSING
+
+
+def test_zero_ttl_is_not_cached(monkeypatch):
+    ttl_cache, _ = make_cache(monkeypatch, maxsize=10, ttl=60, negative_ttl=0)
+    ttl_cache.set("missing", None)
+    assert ttl_cache.get("missing") is MISSING
+    assert not ttl_cache.entries
+
+
+def test_least_recently_used_is_evicted(monkeypatch):
+    ttl_cache, _ = make_cache(monkeypatch, maxsize=2, ttl=60)
+    ttl_cache.set("a", 1)
+    ttl_cache.set("b", 2)
+    # Reading a makes b the least recently used
+    assert ttl_cache.get("a") == 1
+    ttl_cache.set("c", 3)
+    assert ttl_cache.get("b") is MISSING
+    assert ttl_cache.get("a") == 1
+    assert ttl_cache.get("c") == 3
+    assert ttl_cache.stats()["evictions"] == 1
+
+
+def test_invalidate(monkeypatch):
+    ttl_cache, _ = make_cache(monkeypatch, maxsize=10, ttl=60)
+    ttl_cache.set("a", 1)
+    ttl_cache.invalidate("a")
+    ttl_cache.invalidate("unknown")
+    assert ttl_cache.get("a") is MISSING
+    assert ttl_cache.stats()["invalidations"] == 1
+
+
+def test_get_many_loads_only_missing_values(monkeypatch):
+    ttl_cache, _ = make_cache(monkeypatch, maxsize=10, ttl=60)
+    ttl_cache.set(("users", "a"), 1)
+    loaded = []
+
+    async def load(values):
+        loaded.append(set(values))
+        return {"b": 2}
+
+    found = asyncio.run(ttl_cache.get_many("users", ["a", "b", "c"], load))
+    assert found == {"a": 1, "b": 2}
+    assert loaded == [{"b", "c"}]
+    # c was not found and is now cached as a negative entry
+    assert ttl_cache.get(("users", "c")) is None
+    found = asyncio.run(ttl_cache.get_many("users", ["a", "b", "c"], load))
+    assert found == {"a": 1, "b": 2}
+    assert len(loaded) == 1
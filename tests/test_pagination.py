@@ -0,0 +1,51 @@
+from datetime import datetime, timezone
+
+import pytest
+from fastapi import HTTPException
+
+from pagination import decode_cursor, encode_cursor, next_cursor
+
+
+def test_cursor_round_trip():
+    moment = datetime(2025, 6, 13, 15, 31, 51, 123456, tzinfo=timezone.utc)
+    assert decode_cursor(encode_cursor(moment, 42), datetime, int) == [moment, 42]
+
+
+def test_cursor_round_trip_with_null():
+    # Inbox rows without a last_message_at page on id alone
+    assert decode_cursor(encode_cursor(None, 7), datetime | None, int) == [None, 7]
+
+
+def test_cursor_round_trip_with_float():
+    assert decode_cursor(encode_cursor(0.25, 3), float | int, int) == [0.25, 3]
+
+
+@pytest.mark.parametrize("cursor", [
+    "not-base64!",
+    "e30=",
+    encode_cursor(1),
+    encode_cursor(1, 2, 3),
+    # Well formed, but not the types the query expects
+    encode_cursor(1, 2),
+    encode_cursor("x", 2),
+    encode_cursor(datetime(2025, 1, 1), "2"),
+    encode_cursor(datetime(2025, 1, 1), True),
+    encode_cursor(None, 2),
+])
+def test_invalid_cursor(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor, datetime, int)
+    assert error.value.status_code == 400
+
+
+def test_next_cursor_trims_extra_row():
+    rows = [{"id": i} for i in range(4)]
+    cursor = next_cursor(rows, 3, lambda row: (row["id"],))
+    assert rows == [{"id": 0}, {"id": 1}, {"id": 2}]
+    assert decode_cursor(cursor, int) == [2]
+
+
+def test_no_next_cursor_on_last_page():
+    rows = [{"id": i} for i in range(3)]
+    assert next_cursor(rows, 3, lambda row: (row["id"],)) is None
+    assert len(rows) == 3
@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from partitions import add_months, in_range, month_start, partition_name, partition_range
+
+
+def utc(*args) -> datetime:
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("start, months, expected", [
+    (utc(2025, 11, 1), 1, utc(2025, 12, 1)),
+    (utc(2025, 12, 1), 1, utc(2026, 1, 1)),
+    (utc(2025, 12, 1), 13, utc(2027, 1, 1)),
+    (utc(2026, 1, 1), -1, utc(2025, 12, 1)),
+    (utc(2026, 3, 1), -15, utc(2024, 12, 1)),
+    (utc(2026, 3, 1), 0, utc(2026, 3, 1)),
+])
+def test_add_months(start, months, expected):
+    assert add_months(start, months) == expected
+
+
+def test_month_start_is_utc():
+    # Still December 31st in New York, already January in UTC
+    moment = datetime(2025, 12, 31, 20, 30, tzinfo=timezone(timedelta(hours=-5)))
+    assert month_start(moment) == utc(2026, 1, 1)
+
+
+def test_partition_range_across_year_end():
+    assert partition_range("messages_2025_12") == (utc(2025, 12, 1), utc(2026, 1, 1))
+
+
+def test_partition_name_round_trip():
+    start = utc(2024, 2, 1)
+    assert partition_range(partition_name(start))[0] == start
+
+
+@pytest.mark.parametrize("name", ["messages_default", "messages_2025_1", "messages_2025_12; DROP TABLE users", "users"])
+def test_partition_range_rejects_other_names(name):
+    with pytest.raises(ValueError):
+        partition_range(name)
+
+
+def test_in_range_bounds():
+    assert in_range("messages_2025_12") == (
+        "\"timestamp\" >= '2025-12-01T00:00:00+00:00' AND \"timestamp\" < '2026-01-01T00:00:00+00:00'"
+    )
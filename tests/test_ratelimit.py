@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+import config
+from ratelimit import AdaptiveLimiter, retry_after
+
+
+def response(status_code: int = 200, retry: str | None = None) -> httpx.Response:
+    return httpx.Response(status_code, headers={"Retry-After": retry} if retry is not None else None)
+
+
+def limiter(**kwargs) -> AdaptiveLimiter:
+    settings = {"rate": 0, "burst": 1, "initial": 4, "minimum": 1, "maximum": 8, "decrease": 0.5}
+    return AdaptiveLimiter(**{**settings, **kwargs})
+
+
+@pytest.mark.parametrize("value, expected", [(None, None), ("", None), ("2", 2.0), ("0.5", 0.5), ("-3", 0.0), ("soon", None)])
+def test_retry_after_seconds(value, expected):
+    assert retry_after(response(429, value)) == expected
+
+
+def test_retry_after_http_date():
+    moment = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 28 <= retry_after(response(429, format_datetime(moment, usegmt=True))) <= 30
+
+
+def test_retry_after_is_capped(monkeypatch):
+    monkeypatch.setattr(config, "PROVIDER_RETRY_AFTER_MAX", 10.0)
+    assert retry_after(response(429, "3600")) == 10.0
+
+
+def test_success_grows_limit_additively():
+    async def run():
+        adaptive = limiter(initial=4)
+        for _ in range(4):
+            await adaptive.release(await adaptive.acquire(), response(200))
+        return adaptive
+
+    adaptive = asyncio.run(run())
+    assert 4.9 < adaptive.limit < 5.0
+    assert adaptive.in_flight == 0
+
+
+def test_limit_stays_within_bounds():
+    async def run():
+        adaptive = limiter(initial=2, minimum=2, maximum=3)
+        for _ in range(50):
+            await adaptive.release(await adaptive.acquire(), response(200))
+        high = adaptive.limit
+        for _ in range(10):
+            await adaptive.release(await adaptive.acquire(), response(429))
+        return high, adaptive.limit
+
+    assert asyncio.run(run()) == (3, 2)
+
+
+def test_throttle_decreases_once_per_window():
+    async def run():
+        adaptive = limiter(initial=8)
+        # Both requests were sent before either was throttled
+        first, second = await adaptive.acquire(), await adaptive.acquire()
+        await adaptive.release(first, response(429))
+        await adaptive.release(second, response(429))
+        return adaptive
+
+    adaptive = asyncio.run(run())
+    assert adaptive.limit == 4
+    assert adaptive.throttled == 2
+
+
+def test_retry_after_pauses_every_request():
+    async def run():
+        adaptive = limiter()
+        await adaptive.release(await adaptive.acquire(), response(429, "0.2"))
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await adaptive.acquire()
+        return loop.time() - started
+
+    assert asyncio.run(run()) >= 0.15
+
+
+def test_acquire_waits_for_a_free_slot():
+    async def run():
+        adaptive = limiter(initial=1, maximum=1)
+        held = await adaptive.acquire()
+        waiter = asyncio.create_task(adaptive.acquire())
+        await asyncio.sleep(0.01)
+        blocked = not waiter.done()
+        await adaptive.release(held, None)
+        await asyncio.wait_for(waiter, 1)
+        return blocked, adaptive.in_flight
+
+    assert asyncio.run(run()) == (True, 1)